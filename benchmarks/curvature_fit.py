@@ -0,0 +1,106 @@
+'''
+Name: curvature_fit.py
+
+Summary: Accuracy and speed of the batched circle fit (core.curvature.contour_curvatures) against the
+    former per-contour scipy.optimize.leastsq fit, on synthetic leaf-like contours, for a range of
+    Gauss-Newton refinement steps (0 is the pure algebraic fit). Errors are measured against the leastsq
+    curvature. For strongly elongated contours the fitted objective has no finite minimum and both fits
+    drift towards a curvature of 0 at rates that depend on their stopping rules (or stop near the
+    centroid), which is why the median and 95th percentile relative errors are shown together with the
+    number of contours on which the two fits differ by more than 1e-3 / px.
+
+USAGE:
+
+python3 -m benchmarks.curvature_fit
+python3 -m benchmarks.curvature_fit -l 10 100 1000 -s 0 2 5
+
+'''
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+from scipy import optimize
+from tabulate import tabulate
+
+from core.curvature import contour_curvatures
+
+
+class LeastSquaresCurvature:
+    # the per-contour fit contour_curvatures replaced, kept as the reference
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def calc_r(self, xc, yc):
+        return np.sqrt((self.x - xc) ** 2 + (self.y - yc) ** 2)
+
+    def f(self, c):
+        ri = self.calc_r(*c)
+        return ri - ri.mean()
+
+    def df(self, c):
+        xc, yc = c
+        df_dc = np.empty((len(c), self.x.size))
+        ri = self.calc_r(xc, yc)
+        df_dc[0] = (xc - self.x) / ri
+        df_dc[1] = (yc - self.y) / ri
+        return df_dc - df_dc.mean(axis=1)[:, np.newaxis]
+
+    def fit(self):
+        center_estimate = np.r_[np.mean(self.x), np.mean(self.y)]
+        center = optimize.leastsq(self.f, center_estimate, Dfun=self.df, col_deriv=True)[0]
+        return 1 / self.calc_r(*center).mean()
+
+
+def synthetic_contours(n_leaves, seed=0):
+    # external contours of filled, randomly sized and oriented ellipses with a wavy margin
+    rng = np.random.default_rng(seed)
+    contours = []
+    for _ in range(n_leaves):
+        a, b = rng.uniform(20, 120), rng.uniform(8, 40)
+        angle = rng.uniform(0, np.pi)
+        theta = np.linspace(0, 2 * np.pi, 400, endpoint=False)
+        wave = 1 + 0.05 * np.sin(theta * rng.integers(3, 9))
+        x = a * wave * np.cos(theta)
+        y = b * wave * np.sin(theta)
+        xr = x * np.cos(angle) - y * np.sin(angle)
+        yr = x * np.sin(angle) + y * np.cos(angle)
+        polygon = np.stack((xr + 150, yr + 150), axis=1).astype(np.int32)
+        mask = np.zeros((300, 300), dtype=np.uint8)
+        cv2.fillPoly(mask, [polygon], 255)
+        found, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours.append(max(found, key=cv2.contourArea))
+    return contours
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-l', '--leaves', type=int, nargs='+', default=[10, 100, 1000], help='number of contours per image')
+    ap.add_argument('-s', '--steps', type=int, nargs='+', default=[0, 1, 3, 5], help='Gauss-Newton refinement steps to compare')
+    args = vars(ap.parse_args())
+
+    rows = []
+    for n_leaves in args['leaves']:
+        contours = synthetic_contours(n_leaves)
+
+        start = time.perf_counter()
+        reference = []
+        for c in contours:
+            c_np = np.vstack(c).squeeze().astype(np.float64)
+            reference.append(LeastSquaresCurvature(c_np[:, 0], c_np[:, 1]).fit())
+        reference = np.array(reference)
+        rows.append([n_leaves, 'leastsq', time.perf_counter() - start, 0.0, 0.0, 0])
+
+        for steps in args['steps']:
+            start = time.perf_counter()
+            curvatures = contour_curvatures(contours, refine_steps=steps)
+            elapsed = time.perf_counter() - start
+            error = np.abs(curvatures - reference)
+            relative = error / reference
+            rows.append([n_leaves, f"batched, {steps} steps", elapsed, np.median(relative), np.percentile(relative, 95), np.count_nonzero(error > 1e-3)])
+
+    headers = ['contours', 'method', 'time (s)', 'median rel. error', 'p95 rel. error', 'differ by > 1e-3']
+    print(tabulate(rows, headers=headers, tablefmt='orgtbl', floatfmt='.2e'))
@@ -0,0 +1,80 @@
+'''
+Name: kernels.py
+
+Summary: Benchmark the compiled (numba) pixel kernels of core.kernels against their NumPy fallbacks, on
+    synthetic inputs of increasing size: nearest centroid assignment of Lab pixels, cluster label to
+    grey level remapping, per-label area/bounding box/centroid of a watershed-like label image and the
+    double MAD outlier filter. Reports the best time of each, the
+    speedup, whether both give the same result, and the time the first call took to compile (or load
+    from the on-disk cache) each kernel.
+
+USAGE:
+
+python3 -m benchmarks.kernels
+python3 -m benchmarks.kernels -m 1 6 24 -n 5
+
+'''
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+from tabulate import tabulate
+
+from benchmarks.synthetic import best_time
+from core import kernels
+
+
+def same(a, b):
+    if isinstance(a, tuple):
+        return all(same(x, y) for x, y in zip(a, b))
+    return np.array_equal(np.asarray(a), np.asarray(b), equal_nan=np.asarray(a).dtype.kind == 'f')
+
+
+def cases(megapixels, seed=0):
+    # (kernel, numba call, NumPy call) on inputs of about `megapixels`
+    from core import numba_kernels
+    rng = np.random.default_rng(seed)
+    side = int(np.sqrt(megapixels * 1e6))
+    pixels = rng.integers(0, 256, (side * side, 3), dtype=np.uint8)
+    centers = rng.uniform(0, 255, (2, 3)).astype(np.float32)
+    cluster_labels = rng.integers(0, 2, side * side).astype(np.int32)
+    lut = np.array([0, 255], dtype=np.uint8)
+
+    # a few hundred blobs, like leaves out of the watershed
+    seeds = np.zeros((side, side), dtype=np.uint8)
+    seeds[rng.integers(0, side, 300), rng.integers(0, side, 300)] = 255
+    _, labels = cv2.connectedComponents(cv2.dilate(seeds, np.ones((25, 25), np.uint8)))
+    distances = rng.gamma(2, 20, 400)
+
+    return [
+        ('nearest_centroid', lambda: numba_kernels.nearest_centroid_numba(pixels, centers), lambda: kernels.nearest_centroid_numpy(pixels, centers)),
+        ('remap_labels', lambda: numba_kernels.remap_labels_numba(cluster_labels, lut), lambda: kernels.remap_labels_numpy(cluster_labels, lut)),
+        ('label_stats', lambda: numba_kernels.label_stats_numba(labels, int(labels.max()), kernels.chunks(side)), lambda: kernels.label_stats_numpy(labels, int(labels.max()))),
+        ('double_mad_outliers', lambda: numba_kernels.double_mad_outliers_numba(distances, 3.5), lambda: kernels.double_mad_outliers_numpy(distances, 3.5)),
+    ]
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-m', '--megapixels', type=float, nargs='+', default=[1, 6, 12], help='input sizes in megapixels')
+    ap.add_argument('-n', '--repeats', type=int, default=3, help='repetitions per case (best time is reported)')
+    args = vars(ap.parse_args())
+
+    if not kernels.NUMBA:
+        raise SystemExit('numba is not installed (or SPG_DISABLE_NUMBA is set), nothing to compare')
+
+    compile_times = {}
+    rows = []
+    for megapixels in args['megapixels']:
+        for name, compiled, fallback in cases(megapixels):
+            if name not in compile_times:
+                start = time.perf_counter()
+                compiled()
+                compile_times[name] = time.perf_counter() - start
+            numba_time, result = best_time(compiled, args['repeats'])
+            numpy_time, expected = best_time(fallback, args['repeats'])
+            rows.append([name, megapixels, numpy_time, numba_time, numpy_time / numba_time, same(result, expected), compile_times[name]])
+
+    print(tabulate(rows, headers=['kernel', 'megapixels', 'NumPy (s)', 'numba (s)', 'speedup', 'identical', 'first call (s)'], tablefmt='orgtbl', floatfmt='.4f'))
@@ -0,0 +1,106 @@
+'''
+Name: luminosity_screening.py
+
+Summary: Validation report for reduced-resolution luminosity screening (isbright with scale > 1). For
+    every image of a directory (or of a synthetic set of frames with brightness around the threshold,
+    if no directory is given), the normalized luminosity is computed the original way (full decode,
+    floating point L / max(L)) and at each scale, and the report shows per image timings, how many
+    dark/bright decisions agree with the original, the largest difference in normalized luminosity,
+    the wall time of screening all images in parallel, and the images whose decision changed.
+    Downscaling lowers the peak luminosity more than the mean, so screening errs towards bright; the
+    extraction pipeline confirms those images at full resolution. Images screened dark but bright at
+    full resolution would be skipped wrongly and are counted separately.
+
+USAGE:
+
+python3 -m benchmarks.luminosity_screening
+python3 -m benchmarks.luminosity_screening -p /path/to/archive/ -ft jpg,png -l 0.1 -s 1 2 4 8
+
+'''
+
+import argparse
+import contextlib
+import io
+import tempfile
+import time
+from glob import glob
+from os.path import join
+
+import cv2
+import numpy as np
+from tabulate import tabulate
+
+from core.luminous_detection import isbright, screen_luminosity
+from core.options import ImageInput
+
+
+def original_luminosity(path):
+    # the full-resolution floating point computation isbright replaced, kept as the reference
+    image = cv2.imread(path).copy()
+    L, A, B = cv2.split(cv2.cvtColor(image, cv2.COLOR_BGR2LAB))
+    return np.mean(L / np.max(L))
+
+
+def synthetic_archive(directory, n_images, seed=0):
+    # night-like 12 MP frames: a textured background of increasing brightness with a small light source
+    # and a few hot pixels, so that luminosities (mean over peak) span the threshold
+    rng = np.random.default_rng(seed)
+    paths = []
+    for index, level in enumerate(np.linspace(1, 40, n_images)):
+        texture = cv2.resize(rng.uniform(0.5, 1.5, (30, 40, 3)), (4000, 3000), interpolation=cv2.INTER_CUBIC)
+        frame = np.clip(texture * level + rng.normal(0, 2, (3000, 4000, 3)), 0, 255).astype(np.uint8)
+        cv2.circle(frame, (2000, 1500), 20, (255, 255, 255), -1)
+        frame[rng.integers(0, 3000, 50), rng.integers(0, 4000, 50)] = 255
+        path = join(directory, f"frame_{index:03d}.jpg")
+        cv2.imwrite(path, frame)
+        paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-p', '--path', type=str, default=None, help='directory of images to validate on (default: synthetic frames)')
+    ap.add_argument('-ft', '--file_types', type=str, default='jpg,png', help='image file types')
+    ap.add_argument('-l', '--luminosity_threshold', type=float, default=0.1, help='normalized luminosity under which images are dark')
+    ap.add_argument('-s', '--scales', type=int, nargs='+', default=[1, 2, 4, 8], help='decode scales to validate')
+    ap.add_argument('-n', '--synthetic', type=int, default=24, help='number of synthetic frames')
+    ap.add_argument('-j', '--processes', type=int, default=None, help='processes for parallel screening (default: all cores)')
+    args = vars(ap.parse_args())
+
+    with tempfile.TemporaryDirectory() as temporary:
+        if args['path'] is None:
+            paths = synthetic_archive(temporary, args['synthetic'])
+        else:
+            patterns = [ft for ft in args['file_types'].split(',')]
+            paths = sorted(sum((glob(join(args['path'], f"*.{pattern}")) for pattern in patterns + [p.upper() for p in patterns]), []))
+        threshold = args['luminosity_threshold']
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            options = [ImageInput(input_file=path, output_directory=temporary) for path in paths]
+            start = time.perf_counter()
+            reference = np.array([original_luminosity(path) for path in paths])
+            reference_time = (time.perf_counter() - start) / len(paths)
+
+        rows = [['original', reference_time, len(paths), 0, 0.0, None]]
+        mismatches = []
+        for scale in args['scales']:
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                results = [isbright(option, threshold, scale=scale) for option in options]
+                per_image = (time.perf_counter() - start) / len(paths)
+
+                start = time.perf_counter()
+                screen_luminosity(options, threshold, scale, args['processes'])
+                parallel = time.perf_counter() - start
+
+            normalized = np.array([result[1] for result in results])
+            agree = (normalized > threshold) == (reference > threshold)
+            wrongly_dark = np.count_nonzero((normalized <= threshold) & (reference > threshold))
+            rows.append([f"scale 1/{scale}", per_image, int(agree.sum()), wrongly_dark, float(np.abs(normalized - reference).max()), parallel])
+            mismatches += [[scale, paths[i], reference[i], normalized[i]] for i in np.flatnonzero(~agree)]
+
+    print(f"{len(paths)} images, luminosity threshold {threshold}")
+    print(tabulate(rows, headers=['method', 'time per image (s)', 'same decision', 'dark only when screened', 'max abs. difference', 'parallel wall time (s)'], tablefmt='orgtbl', floatfmt='.4f'))
+    if mismatches:
+        print('\nChanged decisions:')
+        print(tabulate(mismatches, headers=['scale', 'image', 'original', 'screened'], tablefmt='orgtbl', floatfmt='.4f'))
@@ -0,0 +1,51 @@
+'''
+Name: marker_match.py
+
+Summary: Benchmark locating the marker (core.luminous_detection.match_marker, coarse to fine) against
+    a single full-resolution cv2.matchTemplate, on synthetic noisy frames of increasing size with the
+    marker template pasted at a random position, and check both find the same location.
+
+USAGE:
+
+python3 -m benchmarks.marker_match
+python3 -m benchmarks.marker_match -t marker_template.png -m 6 12 24 -l 1 2 3 -n 3
+
+'''
+
+import argparse
+
+import cv2
+import numpy as np
+from tabulate import tabulate
+
+from benchmarks.synthetic import best_time, marker_frame
+from core.luminous_detection import match_marker
+
+
+def full_match(img_gray, template):
+    # the full-resolution search match_marker replaced, kept as the reference
+    res = cv2.matchTemplate(img_gray, template, cv2.TM_CCOEFF_NORMED)
+    (y, x) = np.unravel_index(res.argmax(), res.shape)
+    return x, y, float(res[y, x])
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-t', '--template', type=str, default='marker_template.png', help='marker template image')
+    ap.add_argument('-m', '--megapixels', type=float, nargs='+', default=[6, 12, 24], help='frame sizes in megapixels')
+    ap.add_argument('-l', '--levels', type=int, nargs='+', default=[1, 2, 3], help='pyramid levels to compare')
+    ap.add_argument('-n', '--repeats', type=int, default=3, help='repetitions per case (best time is reported)')
+    args = vars(ap.parse_args())
+
+    template = cv2.imread(args['template'], 0)
+    rows = []
+    for megapixels in args['megapixels']:
+        frame, truth = marker_frame(megapixels, template)
+        full_time, (x, y, score) = best_time(lambda: full_match(frame, template), args['repeats'])
+        rows.append([megapixels, 'full resolution', full_time, 1.0, (x, y) == truth, score])
+
+        for levels in args['levels']:
+            elapsed, (x, y, score) = best_time(lambda: match_marker(frame, template, levels), args['repeats'])
+            rows.append([megapixels, f"pyramid, {levels} levels", elapsed, full_time / elapsed, (x, y) == truth, score])
+
+    print(tabulate(rows, headers=['megapixels', 'method', 'time (s)', 'speedup', 'found marker', 'score'], tablefmt='orgtbl', floatfmt='.4f'))
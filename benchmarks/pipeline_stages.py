@@ -0,0 +1,138 @@
+'''
+Name: pipeline_stages.py
+
+Summary: Benchmark suite for the stages of trait extraction on deterministic synthetic rosettes (see
+    benchmarks.synthetic) at several resolutions and leaf counts: color_cluster_seg, color_region,
+    watershed_seg, compute_curv, skeleton_bw + skan summarize, isbright and the full trait_extract, and
+    circle_detect on tray frames of increasing size. Reports the median and best time of each case
+    after a warm-up run. Results can be saved as JSON (-o) and compared against a saved baseline (-b);
+    cases slower than the baseline by more than the tolerance are flagged and the script exits with
+    status 1, so performance regressions are measurable on a CPU-only box.
+
+USAGE:
+
+python3 -m benchmarks.pipeline_stages
+python3 -m benchmarks.pipeline_stages -r 512 1024 2048 -l 6 12 -m 6 12 -n 5 -o baseline.json
+python3 -m benchmarks.pipeline_stages -s watershed_seg compute_curv -b baseline.json -tol 1.2
+python3 -m benchmarks.pipeline_stages -s color_region trait_extract -a none
+
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import time
+from os.path import join
+
+import cv2
+import numpy as np
+from skan import Skeleton, summarize
+from tabulate import tabulate
+
+from benchmarks.synthetic import rosette, tray_frame
+from core.luminous_detection import circle_detect, isbright
+from core.options import ImageInput
+from core.trait_extract_parallel import color_cluster_seg, color_region, compute_curv, skeleton_bw, trait_extract, watershed_seg
+
+STAGES = ['color_cluster_seg', 'color_region', 'watershed_seg', 'compute_curv', 'skeleton_bw+summarize', 'isbright', 'trait_extract', 'circle_detect']
+
+
+def measure(function, repeats):
+    # one untimed run first, which pays for imports and JIT compilation (skan compiles with numba)
+    with contextlib.redirect_stdout(io.StringIO()):
+        function()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)), float(np.min(times))
+
+
+def rosette_cases(resolution, n_leaves, directory, stages, artifacts='debug'):
+    # the stages' inputs are computed once per image, outside the timings
+    image = rosette(resolution, n_leaves)
+    path = join(directory, f"rosette_{resolution}_{n_leaves}.png")
+    cv2.imwrite(path, image)
+    with contextlib.redirect_stdout(io.StringIO()):
+        options = ImageInput(input_file=path, output_directory=directory)
+        mask = color_cluster_seg(image.copy(), 'lab', '1', 2)
+        labels = watershed_seg(image, mask, 20)
+
+    cases = {
+        'color_cluster_seg': lambda: color_cluster_seg(image.copy(), 'lab', '1', 2),
+        'color_region': lambda: color_region(image.copy(), mask, directory + '/', options.input_stem, 5, artifacts=artifacts),
+        'watershed_seg': lambda: watershed_seg(image, mask, 20),
+        'compute_curv': lambda: compute_curv(image, labels),
+        'skeleton_bw+summarize': lambda: summarize(Skeleton(skeleton_bw(mask)[0])),
+        'isbright': lambda: isbright(options, 0.1),
+        'trait_extract': lambda: trait_extract(options, image=image, artifacts=artifacts),
+    }
+    return {stage: case for stage, case in cases.items() if stage in stages}
+
+
+def compare(rows, baseline, tolerance):
+    # append the ratio to the baseline's median and whether it is a regression to each row
+    reference = {(row['stage'], row['size'], row['leaves']): row['median'] for row in baseline}
+    regressions = 0
+    for row in rows:
+        previous = reference.get((row['stage'], row['size'], row['leaves']))
+        ratio = row['median'] / previous if previous else None
+        regressed = ratio is not None and ratio > tolerance
+        regressions += regressed
+        row.update(ratio=ratio, regressed=regressed)
+    return regressions
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-r', '--resolutions', type=int, nargs='+', default=[512, 1024], help='side length of the synthetic rosettes')
+    ap.add_argument('-l', '--leaves', type=int, nargs='+', default=[6, 12], help='leaf counts of the synthetic rosettes')
+    ap.add_argument('-m', '--megapixels', type=float, nargs='+', default=[6, 12], help='tray frame sizes for circle_detect')
+    ap.add_argument('-s', '--stages', type=str, nargs='+', default=STAGES, choices=STAGES, help='stages to benchmark')
+    ap.add_argument('-t', '--template', type=str, default='marker_template.png', help='marker template for circle_detect')
+    ap.add_argument('-a', '--artifacts', type=str, default='debug', choices=['none', 'summary', 'debug'], help='images color_region and trait_extract draw and write')
+    ap.add_argument('-n', '--repeats', type=int, default=3, help='repetitions per case (median and best are reported)')
+    ap.add_argument('-o', '--output', type=str, default=None, help='save the results to this JSON file')
+    ap.add_argument('-b', '--baseline', type=str, default=None, help='compare against results saved with -o')
+    ap.add_argument('-tol', '--tolerance', type=float, default=1.25, help='slowdown over the baseline median flagged as a regression')
+    args = vars(ap.parse_args())
+
+    rows = []
+    with tempfile.TemporaryDirectory() as temporary:
+        for resolution in args['resolutions']:
+            for n_leaves in args['leaves']:
+                for stage, case in rosette_cases(resolution, n_leaves, temporary, args['stages'], args['artifacts']).items():
+                    median, best = measure(case, args['repeats'])
+                    rows.append({'stage': stage, 'size': f"{resolution}x{resolution}", 'leaves': n_leaves, 'median': median, 'best': best})
+
+        if 'circle_detect' in args['stages']:
+            template = cv2.imread(args['template'], 0)
+            for megapixels in args['megapixels']:
+                path = join(temporary, f"tray_{megapixels}.jpg")
+                cv2.imwrite(path, tray_frame(megapixels, template))
+                median, best = measure(lambda: circle_detect(path, args['template']), args['repeats'])
+                rows.append({'stage': 'circle_detect', 'size': f"{megapixels} MP", 'leaves': 8, 'median': median, 'best': best})
+
+    headers = ['stage', 'size', 'leaves', 'median (s)', 'best (s)']
+    keys = ['stage', 'size', 'leaves', 'median', 'best']
+    regressions = 0
+    if args['baseline']:
+        with open(args['baseline']) as file:
+            regressions = compare(rows, json.load(file), args['tolerance'])
+        headers += ['vs. baseline', 'regression']
+        keys += ['ratio', 'regressed']
+
+    print(tabulate([[row[key] for key in keys] for row in rows], headers=headers, tablefmt='orgtbl', floatfmt='.4f'))
+
+    if args['output']:
+        with open(args['output'], 'w') as file:
+            json.dump([{key: row[key] for key in ['stage', 'size', 'leaves', 'median', 'best']} for row in rows], file, indent=2)
+
+    if args['baseline']:
+        print(f"\n{regressions} of {len(rows)} cases more than {args['tolerance']}x slower than {args['baseline']}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,63 @@
+'''
+Name: startup_time.py
+
+Summary: Startup time of the CLI: wall time of `spg --help` (as `python -m core.cli --help`, median of
+    several runs) against a target, and the slowest imports (cumulative, from `python -X importtime`)
+    of the CLI module and of the modules the extract command and its workers load. Exits with status 1
+    if `spg --help` is slower than the target, so it can be tracked in CI.
+
+USAGE:
+
+python3 -m benchmarks.startup_time
+python3 -m benchmarks.startup_time -n 10 -t 300 -m core.cli core.extraction -k 15
+
+'''
+
+import argparse
+import subprocess
+import sys
+import time
+
+import numpy as np
+from tabulate import tabulate
+
+
+def help_time(repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'core.cli', '--help'], check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return np.median(times)
+
+
+def import_times(module):
+    # (cumulative microseconds, module) for every import, as reported by -X importtime on stderr
+    log = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], check=True, capture_output=True, text=True).stderr
+    times = []
+    for line in log.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times.append((int(cumulative), name.strip()))
+    return times
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-n', '--repeats', type=int, default=5, help='runs of spg --help (the median is reported)')
+    ap.add_argument('-t', '--target', type=float, default=300, help='target for spg --help in milliseconds')
+    ap.add_argument('-m', '--modules', type=str, nargs='+', default=['core.cli', 'core.extraction'], help='modules to profile imports of')
+    ap.add_argument('-k', '--top', type=int, default=10, help='number of slowest imports to show per module')
+    args = vars(ap.parse_args())
+
+    for module in args['modules']:
+        times = sorted(import_times(module), reverse=True)
+        rows = [[name, cumulative / 1000] for cumulative, name in times[:args['top']]]
+        print(f"Slowest imports of {module}:")
+        print(tabulate(rows, headers=['module', 'cumulative (ms)'], tablefmt='orgtbl', floatfmt='.1f') + '\n')
+
+    elapsed = help_time(args['repeats']) * 1000
+    within = elapsed <= args['target']
+    print(f"spg --help: {elapsed:.0f} ms (target {args['target']:.0f} ms, {'met' if within else 'missed'})")
+    sys.exit(0 if within else 1)
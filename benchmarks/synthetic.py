@@ -0,0 +1,125 @@
+'''
+Name: synthetic.py
+
+Summary: Deterministic synthetic test images for the benchmarks: top-down views of a rosette plant on
+    soil at a given resolution and leaf count (rosette), camera frames of a tray with the marker
+    template next to a rosette, laid out where marker_crop looks for the plant (tray_frame), noisy
+    grayscale frames with the marker template at a random position (marker_frame) and binary masks of
+    disks (disk_mask). The same arguments always give the same image. Also the benchmarks' shared
+    timer (best_time). Run as a script to write a few samples.
+
+USAGE:
+
+python3 -m benchmarks.synthetic -o samples/ -r 512 1024 -l 6 12
+
+'''
+
+import argparse
+import contextlib
+import io
+import time
+from os.path import join
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+
+def soil(height, width, rng):
+    # brownish background with coarse blotches and fine grain
+    blotches = cv2.resize(rng.uniform(0.7, 1.3, (max(2, height // 64), max(2, width // 64), 1)), (width, height), interpolation=cv2.INTER_CUBIC)
+    base = np.array([45, 60, 85], dtype=np.float64)  # BGR
+    return np.clip(blotches.reshape(height, width, 1) * base + rng.normal(0, 6, (height, width, 3)), 0, 255).astype(np.uint8)
+
+
+def draw_rosette(image, center, radius, n_leaves, rng):
+    # elliptical leaves radiating from the center, of varying length, width and shade, over a small core
+    angles = np.linspace(0, 2 * np.pi, n_leaves, endpoint=False) + rng.uniform(-0.15, 0.15, n_leaves)
+    for angle in angles:
+        length = radius * rng.uniform(0.35, 0.5)
+        width = max(2.0, length * rng.uniform(0.25, 0.4) * min(1.0, np.sqrt(8 / n_leaves)))
+        x = center[0] + length * np.cos(angle)
+        y = center[1] + length * np.sin(angle)
+        color = (int(rng.integers(30, 60)), int(rng.integers(130, 190)), int(rng.integers(40, 80)))
+        cv2.ellipse(image, (int(x), int(y)), (int(length), int(width)), float(np.degrees(angle)), 0, 360, color, -1, cv2.LINE_AA)
+    cv2.circle(image, (int(center[0]), int(center[1])), max(2, int(radius * 0.12)), (45, 150, 70), -1, cv2.LINE_AA)
+    return image
+
+
+def rosette(resolution: int, n_leaves: int, seed: int = 0) -> np.ndarray:
+    """ a square BGR image, `resolution` pixels on a side, of a rosette with `n_leaves` leaves on soil """
+    rng = np.random.default_rng((seed, resolution, n_leaves))
+    image = soil(resolution, resolution, rng)
+    return draw_rosette(image, (resolution / 2, resolution / 2), resolution / 2, n_leaves, rng)
+
+
+def tray_frame(megapixels: float, template: np.ndarray, n_leaves: int = 8, seed: int = 0) -> np.ndarray:
+    """
+    a 4:3 BGR camera frame of about `megapixels` with the (grayscale) marker template pasted on the soil
+    and a rosette in the 650 x 700 region to its left and below it, which marker_crop crops out
+    """
+    rng = np.random.default_rng((seed, int(megapixels * 1000), n_leaves))
+    height = max(1000, int(np.sqrt(megapixels * 1e6 * 3 / 4)))
+    width = max(1000, int(height * 4 / 3))
+    image = soil(height, width, rng)
+
+    h, w = template.shape
+    x, y = width - w - 20, 20
+    image[y:y + h, x:x + w] = cv2.cvtColor(template, cv2.COLOR_GRAY2BGR)
+    return draw_rosette(image, (x - 325, y + 500), 300, n_leaves, rng)
+
+
+def marker_frame(megapixels: float, template: np.ndarray, seed: int = 0):
+    """ a smooth, noisy 4:3 grayscale frame with the template pasted at a random position, and that position """
+    rng = np.random.default_rng(seed)
+    height = int(np.sqrt(megapixels * 1e6 * 3 / 4))
+    width = int(height * 4 / 3)
+    background = cv2.resize(rng.integers(40, 200, (height // 64, width // 64), dtype=np.uint8), (width, height), interpolation=cv2.INTER_CUBIC)
+    frame = cv2.add(background, rng.integers(0, 12, (height, width), dtype=np.uint8))
+    h, w = template.shape
+    y, x = int(rng.integers(0, height - h)), int(rng.integers(0, width - w))
+    frame[y:y + h, x:x + w] = template
+    return frame, (x, y)
+
+
+def disk_mask(resolution: int, n_components: int, seed: int = 0) -> np.ndarray:
+    """ a square binary mask with `n_components` non-overlapping disks on a grid, all above the minimum component size """
+    rng = np.random.default_rng(seed)
+    mask = np.zeros((resolution, resolution), dtype=np.uint8)
+    per_side = int(np.ceil(np.sqrt(n_components)))
+    cell = resolution // (per_side + 1)
+    radius = max(19, cell // 3)
+    for index in range(n_components):
+        row, col = divmod(index, per_side)
+        center = (int((col + 1) * cell + rng.integers(-2, 3)), int((row + 1) * cell + rng.integers(-2, 3)))
+        cv2.circle(mask, center, radius, 255, -1)
+    return mask
+
+
+def best_time(function, repeats: int, quiet: bool = False):
+    """ the best of `repeats` timings of calling `function` (with its output discarded if `quiet`), and its result """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+            result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-o', '--output_directory', type=str, default='.', help='directory to write the samples to')
+    ap.add_argument('-r', '--resolutions', type=int, nargs='+', default=[512, 1024, 2048], help='side length of the rosette images')
+    ap.add_argument('-l', '--leaves', type=int, nargs='+', default=[6, 12], help='leaf counts')
+    ap.add_argument('-t', '--template', type=str, default='marker_template.png', help='marker template for a tray frame (skipped if missing)')
+    args = vars(ap.parse_args())
+
+    Path(args['output_directory']).mkdir(parents=True, exist_ok=True)
+    for resolution in args['resolutions']:
+        for n_leaves in args['leaves']:
+            cv2.imwrite(join(args['output_directory'], f"rosette_{resolution}_{n_leaves}.png"), rosette(resolution, n_leaves))
+
+    template = cv2.imread(args['template'], 0)
+    if template is not None:
+        cv2.imwrite(join(args['output_directory'], 'tray_12mp.jpg'), tray_frame(12, template))
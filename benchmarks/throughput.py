@@ -0,0 +1,119 @@
+'''
+Name: throughput.py
+
+Summary: Benchmark the throughput of `spg extract` (images per second) for combinations of worker
+    processes and threads per worker, to find the best configuration of --workers and
+    --threads_per_worker on a machine. By default every split of the cores into workers times threads
+    is run, plus every core as a worker with unlimited threads, which is what oversubscription looks
+    like. Runs on the images of a directory, or on deterministic synthetic tray frames (see
+    benchmarks.synthetic). Each configuration runs `--repeats` times, each in a fresh process, after
+    an untimed single image warm-up; the best and median throughput are reported. A configuration
+    whose process dies (e.g. out of memory) is reported as failed.
+
+USAGE:
+
+python3 -m benchmarks.throughput
+python3 -m benchmarks.throughput -i ~/plant-image-analysis/test/ -a summary
+python3 -m benchmarks.throughput -w 4 8 16 -t 1 2 4 -m 12 -n 32 -r 3
+
+'''
+
+import argparse
+import contextlib
+import glob
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+from os.path import join
+
+import cv2
+from tabulate import tabulate
+
+from benchmarks.synthetic import tray_frame
+from core.extraction import ExtractionPipeline, run_streaming
+from core.options import ImageInput
+
+
+def configurations(cores, workers=None, threads=None):
+    # (workers, threads per worker) pairs: the given ones, or every split of the cores plus full oversubscription
+    if workers or threads:
+        return [(w, t) for w in workers or [cores] for t in threads or [max(1, cores // w)]]
+    splits = [(w, cores // w) for w in range(1, cores + 1) if cores % w == 0]
+    return splits + ([(cores, cores)] if cores > 1 else [])
+
+
+def throughput(pipeline, files, workers, threads):
+    with tempfile.TemporaryDirectory() as output_directory:
+        images = [ImageInput(input_file=file, output_directory=output_directory) for file in files]
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            run_streaming(pipeline, images, output_directory, workers, threads=threads)
+            return len(images) / (time.perf_counter() - start)
+
+
+def run_configuration(sender, pipeline, files, workers, threads):
+    sender.send(throughput(pipeline, files, workers, threads))
+
+
+def measure(pipeline, files, workers, threads):
+    # in a fresh process, so that thread limits don't carry over from one configuration to the next
+    # (and this one never starts the compiled kernels' thread pool, which doesn't survive forking)
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=run_configuration, args=(sender, pipeline, files, workers, threads))
+    process.start()
+    # only the child's end is left open, so that receiving fails instead of blocking if it dies
+    sender.close()
+    try:
+        rate = receiver.recv()
+    except EOFError:
+        rate = None
+    process.join()
+    if rate is None or process.exitcode != 0:
+        print(f"--workers {workers} --threads_per_worker {threads} failed (exit code {process.exitcode})")
+        return None
+    return rate
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-i', '--input', type=str, default=None, help='directory of images (by default, synthetic tray frames)')
+    ap.add_argument('-ft', '--file_types', type=str, default='jpg,png', help='extensions of the images in the input directory')
+    ap.add_argument('-m', '--megapixels', type=float, default=2, help='size of the synthetic tray frames')
+    ap.add_argument('-n', '--images', type=int, default=None, help='number of images (by default 2 per core, or all of the input directory)')
+    ap.add_argument('-w', '--workers', type=int, nargs='+', default=None, help='worker process counts to try')
+    ap.add_argument('-t', '--threads', type=int, nargs='+', default=None, help='threads per worker to try (by default each worker\'s share of the cores)')
+    ap.add_argument('-tp', '--template', type=str, default='marker_template.png', help='marker template')
+    ap.add_argument('-a', '--artifacts', type=str, default='none', choices=['none', 'summary', 'debug'], help='images to write besides the traits')
+    ap.add_argument('-r', '--repeats', type=int, default=1, help='runs per configuration (best and median are reported)')
+    args = vars(ap.parse_args())
+
+    cores = os.cpu_count()
+    template = cv2.imread(args['template'], 0)
+    pipeline = ExtractionPipeline(template, artifacts=args['artifacts'])
+
+    with tempfile.TemporaryDirectory() as temporary:
+        if args['input']:
+            files = sorted(sum((glob.glob(join(args['input'], f"*.{file_type}")) for file_type in args['file_types'].split(',')), []))
+            files = files[:args['images']] if args['images'] else files
+        else:
+            files = []
+            for seed in range(args['images'] or 2 * cores):
+                files.append(join(temporary, f"tray_{seed}.jpg"))
+                cv2.imwrite(files[-1], tray_frame(args['megapixels'], template, 6 + seed % 7, seed))
+
+        measure(pipeline, files[:1], 1, None)
+
+        rows = []
+        for workers, threads in configurations(cores, args['workers'], args['threads']):
+            rates = [measure(pipeline, files, workers, threads) for _ in range(args['repeats'])]
+            if None in rates:
+                rows.append([workers, threads, workers * threads, 'failed', 'failed'])
+            else:
+                rows.append([workers, threads, workers * threads, max(rates), statistics.median(rates)])
+
+    rows.sort(key=lambda row: -row[3] if isinstance(row[3], float) else 0)
+    print(tabulate(rows, headers=['workers', 'threads per worker', 'threads', 'best images/s', 'median images/s'], tablefmt='orgtbl', floatfmt='.3f'))
+    if isinstance(rows[0][3], float):
+        print(f"\n{len(files)} images on {cores} cores, best: --workers {rows[0][0]} --threads_per_worker {rows[0][1]}")
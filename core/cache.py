@@ -0,0 +1,106 @@
+import hashlib
+import os
+from glob import glob
+from os.path import join
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+# bump to invalidate entries written by an incompatible version of the stages
+CACHE_VERSION = 1
+
+
+def content_hash(*parts) -> str:
+    """ hash of arrays (by dtype, shape and contents) and of anything else by its repr """
+    digest = hashlib.blake2b(repr(CACHE_VERSION).encode(), digest_size=20)
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            digest.update(f"{part.dtype}{part.shape}".encode())
+            digest.update(np.ascontiguousarray(part).data)
+        else:
+            digest.update(repr(part).encode())
+    return digest.hexdigest()
+
+
+class ArrayCache:
+    """
+    Content-addressed store of intermediate arrays (segmentation masks, watershed labels, skeletons) as
+    compressed .npz files in a directory, so that stages whose inputs did not change are not computed
+    again. Keys are hashes of a stage's inputs and parameters (see content_hash). Reading an entry
+    refreshes its modification time, and whenever the directory grows beyond `max_bytes` the least
+    recently used entries are evicted. The directory's size is scanned once and then kept up to date
+    with each save, and scanned again when evicting. Writes are atomic, so several processes can share
+    a directory (each only counts its own saves between scans, so the directory can outgrow the limit
+    by what the others saved in the meantime).
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        self.size = sum(size for _, size, _ in self.entries())
+
+    def path(self, key: str) -> str:
+        return join(self.directory, f"{key}.npz")
+
+    def load(self, key: str) -> Optional[np.ndarray]:
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                array = data['array']
+            os.utime(path)
+            return array
+        except (OSError, KeyError, ValueError):
+            # missing, evicted by another process in the meantime, or incomplete
+            return None
+
+    def save(self, key: str, array: np.ndarray):
+        temporary = f"{self.path(key)}.{os.getpid()}.tmp"
+        with open(temporary, 'wb') as file:
+            np.savez_compressed(file, array=array)
+        self.size += os.path.getsize(temporary)
+        os.replace(temporary, self.path(key))
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        # (modification time, size, path) of every entry
+        entries = []
+        for path in glob(join(self.directory, '*.npz')):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self.size = total
+
+    def fetch(self, key: str, compute: Callable[[], np.ndarray], stage: str = 'array') -> np.ndarray:
+        array = self.load(key)
+        if array is not None:
+            print(f"Reusing cached {stage} {key}")
+            return array
+
+        array = compute()
+        self.save(key, array)
+        return array
+
+
+def cached(cache: Optional[ArrayCache], stage: str, parts: tuple, compute: Callable[[], np.ndarray]) -> np.ndarray:
+    """ compute() or, given a cache, the stage's cached result for the inputs and parameters in `parts` """
+    if cache is None:
+        return compute()
+    return cache.fetch(content_hash(stage, *parts), compute, stage)
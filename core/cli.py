@@ -1,16 +1,15 @@
-from contextlib import closing
 from glob import glob
-from multiprocessing import cpu_count, Pool
+from multiprocessing import cpu_count
 from os.path import join
 from pathlib import Path
 
 import click
-import cv2
 
-from core.luminous_detection import circle_detect, image_enhance, check_discard_merge, check_discard_merge2
 from core.options import ImageInput
-from core.trait_extract_parallel import trait_extract
-from core.utils import write_results
+
+# Subcommands import OpenCV and the analysis modules (and through them matplotlib, scikit-learn, skan,
+# scikit-image, ...) when they run, not at module import, so `spg --help` and the lighter commands
+# start quickly. See benchmarks/startup_time.py.
 
 
 @click.group()
@@ -24,6 +23,9 @@ def cli():
 @click.option('-ft', '--file_types', required=False, type=str, default='jpg,png')
 @click.option('-r', '--replace', is_flag=True)
 def enhance(source, output_directory, file_types, replace):
+    import cv2
+    from core.luminous_detection import image_enhance
+
     Path(output_directory).mkdir(parents=True, exist_ok=True)
 
     get_path = lambda i: f"{join(i.output_directory, i.input_stem)}.png" if replace else f"{join(i.output_directory, i.input_stem)}.enhanced.png"
@@ -69,28 +71,53 @@ def enhance(source, output_directory, file_types, replace):
 @click.option('-l', '--luminosity_threshold', required=False, type=float, default=0.1)
 @click.option('-t', '--template', required=False, type=str, default='marker_template.png')
 @click.option('-m', '--multiprocessing', is_flag=True)
-def extract(source, output_directory, file_types, luminosity_threshold, template, multiprocessing):
+@click.option('-w', '--warm_start', is_flag=True)
+@click.option('-c', '--chunksize', required=False, type=int, default=None)
+@click.option('--cache_directory', required=False, type=str, default=None)
+@click.option('--cache_size', required=False, type=int, default=1024)
+@click.option('-d', '--debug', is_flag=True)
+@click.option('-tm', '--track_marker', is_flag=True)
+@click.option('-ls', '--luminosity_scale', required=False, type=click.Choice(['1', '2', '4', '8']), default='1')
+@click.option('-a', '--artifacts', required=False, type=click.Choice(['none', 'summary', 'debug']), default='debug')
+@click.option('--image_format', required=False, type=click.Choice(['png', 'jpg', 'webp']), default=None)
+@click.option('--compression', required=False, type=int, default=None)
+@click.option('--writer_threads', required=False, type=int, default=2)
+@click.option('--max_memory', required=False, type=int, default=None)
+@click.option('--max_tasks_per_child', required=False, type=int, default=10)
+@click.option('--workers', required=False, type=int, default=None)
+@click.option('--threads_per_worker', required=False, type=int, default=None)
+def extract(source, output_directory, file_types, luminosity_threshold, template, multiprocessing, warm_start, chunksize, cache_directory, cache_size, debug, track_marker, luminosity_scale, artifacts, image_format, compression, writer_threads, max_memory, max_tasks_per_child, workers, threads_per_worker):
+    import cv2
+    from core.cache import ArrayCache
+    from core.extraction import ExtractionPipeline, run_streaming
+    from core.luminous_detection import read_marker_positions, write_marker_positions, write_results_to_csv
+    from core.manifest import Manifest
+    from core.profiling import ProfileWriter, read_profile
+    from core.scheduler import MemoryModel
+    from core.utils import deduplicate_results, write_results
+    from core.workers import limit_threads, worker_threads
+
     Path(output_directory).mkdir(parents=True, exist_ok=True)
 
+    # the template is decoded once and handed to every image's pipeline
+    marker = cv2.imread(template, 0)
+
+    # segmentation masks, watershed labels and skeletons, reused by later runs on the same images
+    cache = ArrayCache(cache_directory, cache_size * 1024 * 1024) if cache_directory else None
+
     if Path(source).is_file():
-        # check luminosity
         image = ImageInput(input_file=source, output_directory=output_directory)
-        print(f"Checking image quality")
-        if check_discard_merge2([image], luminosity_threshold):
+        pipeline = ExtractionPipeline(marker, luminosity_threshold, enhance=True, cache=cache, debug=debug, luminosity_scale=int(luminosity_scale), artifacts=artifacts, image_format=image_format, compression=compression, writer_threads=writer_threads)
+        if threads_per_worker:
+            limit_threads(threads_per_worker)
+        luminosity, result, _, stages = pipeline(image)
+        write_results_to_csv([luminosity], output_directory)
+        with ProfileWriter(output_directory) as profile:
+            profile.write(stages)
+        if result is None:
             print(f"{source} is too dark!")
         else:
-            print(f"{source} is light enough.")
-
-        # crop
-        input = ImageInput(input_file=join(output_directory, Path(source).name), output_directory=output_directory)
-        cropped = circle_detect(input.input_file, template)
-        enhanced = image_enhance(cropped)
-        enhanced.save(f"{join(input.output_directory, input.input_stem)}.png")
-
-        # extract traits
-        image = ImageInput(input_file=join(output_directory, Path(source).name), output_directory=output_directory)
-        result = trait_extract(image)
-        write_results(image.output_directory, [result])
+            write_results(image.output_directory, [result])
     elif Path(source).is_dir():
         patterns = [ft.lower() for ft in file_types.split(',')]
         if 'jpg' in patterns:
@@ -103,35 +130,66 @@ def extract(source, output_directory, file_types, luminosity_threshold, template
         images = [ImageInput(input_file=file, output_directory=output_directory) for file in files]
         print(f"Found {len(files)} files with extensions {', '.join(patterns)}: \n" + '\n'.join(files))
 
-        # check luminosity
-        check_discard_merge2(images, luminosity_threshold)
-
-        # manipulate images in the output directory from here on
-        images = [ImageInput(input_file=join(output_directory, Path(file).name), output_directory=output_directory) for file in files]
-
-        # crop
-        for input in images:
-            cropped = circle_detect(input.input_file, template)
-            if cropped.size == 0:
-                print(f"No circle found, nothing to crop")
-            else:
-                cv2.imwrite(f"{join(input.output_directory, input.input_stem)}.png", cropped)
-
-        # extract traits
-        if multiprocessing:
-            processes = cpu_count()
-            print(f"Using up to {processes} processes to extract traits from {len(files)} images")
-            with closing(Pool(processes=processes)) as pool:
-                results = pool.map(trait_extract, images)
-                pool.terminate()
+        # process each camera's images together, in timestamp order, when every image has one (warm-started
+        # clustering needs each time series in order, and each worker is handed chunks of consecutive images)
+        if all(image.timestamp is not None for image in images):
+            images = sorted(images, key=lambda i: (i.series, i.timestamp))
+
+        # with fixed cameras, start each camera's marker search where the previous run last found it
+        positions_file = join(output_directory, 'marker_positions.json')
+        previous_positions = read_marker_positions(positions_file) if track_marker else None
+
+        # skip images completed by an earlier run with the same parameters (failed ones are retried)
+        pipeline = ExtractionPipeline(marker, luminosity_threshold, warm_start=warm_start, cache=cache, debug=debug, marker_positions=previous_positions, luminosity_scale=int(luminosity_scale), artifacts=artifacts, image_format=image_format, compression=compression, writer_threads=writer_threads)
+        manifest = Manifest(output_directory, pipeline.parameters())
+        remaining = [image for image in images if not manifest.completed(image)]
+        if len(remaining) < len(images):
+            print(f"Skipping {len(images) - len(remaining)} images completed in a previous run")
+
+        # check luminosity, crop and extract traits, decoding each image once and writing results as they finish
+        # each worker's libraries (OpenCV, BLAS/OpenMP, compiled kernels) get its share of the cores by default
+        processes = workers or (cpu_count() if multiprocessing else 1)
+        if processes > 1:
+            threads = threads_per_worker or worker_threads(processes)
+            print(f"Using up to {processes} processes with {threads} threads each to extract traits from {len(remaining)} images")
         else:
-            print(f"Using a single process to extract traits from {len(files)} images")
-            results = [trait_extract(image) for image in images]
-
-        write_results(images[0].output_directory, results)
+            print(f"Using a single process to extract traits from {len(remaining)} images")
+        # with a memory budget (in MB), estimate each image's memory from a previous run's profile, if any
+        memory_model = None
+        profile_file = join(output_directory, 'profile.jsonl')
+        if max_memory is not None:
+            memory_model = MemoryModel().calibrate(read_profile(profile_file)) if Path(profile_file).is_file() else MemoryModel()
+
+        positions = {} if track_marker else None
+        run_streaming(pipeline, remaining, output_directory, processes, chunksize, manifest, positions, max_memory, memory_model, threads_per_worker, max_tasks_per_child or None)
+        if track_marker:
+            write_marker_positions(positions_file, {**previous_positions, **positions})
+        deduplicate_results(output_directory)
     else:
         print(f"File not found: {source}")
 
 
+@cli.command()
+@click.argument('source')
+def profile(source):
+    """ Summarize the per-stage timing and memory use recorded by extract (a profile.jsonl or its directory). """
+    from tabulate import tabulate
+    from core.profiling import read_profile, summarize_profile
+
+    path = join(source, 'profile.jsonl') if Path(source).is_dir() else source
+    if not Path(path).is_file():
+        print(f"File not found: {path}")
+        return
+
+    records = read_profile(path)
+    images = len({record['image'] for record in records})
+    print(f"{len(records)} stage records for {images} images in {path}")
+    print(tabulate(
+        summarize_profile(records),
+        headers=['stage', 'images', 'p50 wall (s)', 'p90 wall (s)', 'p99 wall (s)', 'mean wall (s)', '% of total', 'mean cpu (s)', 'cpu/wall', 'peak RSS (MB)', 'RSS growth (MB)'],
+        tablefmt='orgtbl',
+        floatfmt='.3f'))
+
+
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,210 @@
+from typing import TYPE_CHECKING, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from core import kernels
+
+if TYPE_CHECKING:
+    from sklearn.cluster import KMeans
+
+
+def histogram_kmeans(channel: np.ndarray, n_clusters: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    K-means over a single uint8 channel, computed in the histogram domain.
+
+    Pixels with equal intensity always land in the same cluster and optimal 1D clusters are contiguous
+    intensity ranges, so the (at most 256) occupied histogram bins, weighted by their pixel counts, are
+    partitioned exactly by dynamic programming over range costs. This is the global optimum that the
+    restarts of a per-pixel k-means aim for, found deterministically in milliseconds. Returns a 256-entry
+    label lookup table (labels ordered by intensity) and the number of pixels in each cluster.
+    """
+    hist = np.bincount(channel.ravel(), minlength=256)
+    values = np.flatnonzero(hist)
+    weights = hist[values].astype(np.float64)
+    lut = np.zeros(256, dtype=np.uint8)
+    n = len(values)
+
+    if n <= n_clusters:
+        # fewer distinct intensities than clusters, each one is its own cluster
+        lut[values] = np.arange(n)
+    else:
+        # centre the intensities to keep the prefix sums well conditioned
+        x = values - np.average(values, weights=weights)
+        cw = np.concatenate(([0], np.cumsum(weights)))
+        cs = np.concatenate(([0], np.cumsum(weights * x)))
+        cq = np.concatenate(([0], np.cumsum(weights * x * x)))
+
+        # cost[i, j]: within-cluster sum of squares of a cluster spanning occupied bins i..j
+        start = np.arange(n)[:, None]
+        end = np.arange(n)[None, :]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s = cs[end + 1] - cs[start]
+            cost = (cq[end + 1] - cq[start]) - s * s / (cw[end + 1] - cw[start])
+        cost[end < start] = np.inf
+
+        # best[m, j]: lowest cost of splitting bins 0..j into m + 1 clusters, first[m, j]: where the last one starts
+        best = np.empty((n_clusters, n))
+        first = np.zeros((n_clusters, n), dtype=np.int64)
+        best[0] = cost[0]
+        for m in range(1, n_clusters):
+            candidates = np.concatenate(([np.inf], best[m - 1][:-1]))[:, None] + cost
+            first[m] = np.argmin(candidates, axis=0)
+            best[m] = candidates[first[m], np.arange(n)]
+
+        end = n - 1
+        for m in range(n_clusters - 1, -1, -1):
+            begin = first[m, end]
+            lut[values[begin:end + 1]] = m
+            end = begin - 1
+
+    counts = np.bincount(lut[values], weights=hist[values], minlength=n_clusters)
+    return lut, counts
+
+
+def rank_levels(counts: np.ndarray, n_clusters: int) -> np.ndarray:
+    """
+    Map each cluster label to a grey level, ranking clusters by how many pixels they hold
+    (the most frequent cluster gets 0, the least frequent 255).
+    """
+    ranks = np.empty(n_clusters, dtype=np.int64)
+    ranks[np.argsort(-counts, kind='stable')] = np.arange(n_clusters)
+    return (ranks * int(255 / (n_clusters - 1))).astype(np.uint8)
+
+
+def sample_indices(height: int, width: int, fraction: float, sampling: str = 'random', seed: int = 0) -> np.ndarray:
+    """
+    Flat indices of a spatially stratified subsample of roughly `fraction` of an image's pixels.
+    The image is tiled into square cells holding one sample each: with 'grid' sampling it is the
+    cell's top left pixel, with 'random' a pixel drawn uniformly from within the cell.
+    """
+    if not 0 < fraction <= 1:
+        raise ValueError("Sample fraction must be in (0, 1]")
+
+    step = max(1, int(round(1 / np.sqrt(fraction))))
+    rows, cols = np.meshgrid(np.arange(0, height, step), np.arange(0, width, step), indexing='ij')
+
+    if sampling == 'random':
+        rng = np.random.default_rng(seed)
+        rows = np.minimum(rows + rng.integers(0, step, rows.shape), height - 1)
+        cols = np.minimum(cols + rng.integers(0, step, cols.shape), width - 1)
+    elif sampling != 'grid':
+        raise ValueError(f"Unknown sampling method: {sampling} (expected 'random' or 'grid')")
+
+    return (rows * width + cols).ravel()
+
+
+def nearest_centroid(pixels: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    """
+    Assign each row of an (n, c) pixel matrix to its nearest centroid: in parallel without any
+    temporary arrays when numba is available, otherwise a chunk of pixels at a time to bound the size
+    of the distance matrix (see core.kernels).
+    """
+    return kernels.nearest_centroid(pixels, centers)
+
+
+def label_agreement(labels: np.ndarray, reference: np.ndarray, n_clusters: int) -> float:
+    """
+    Fraction of pixels that two clusterings put in the same cluster, after matching each cluster of
+    one to a cluster of the other so as to maximise the overlap.
+    """
+    from scipy.optimize import linear_sum_assignment
+
+    overlap = np.bincount(labels.astype(np.int64) * n_clusters + reference, minlength=n_clusters * n_clusters)
+    overlap = overlap.reshape(n_clusters, n_clusters)
+    rows, cols = linear_sum_assignment(-overlap)
+    return overlap[rows, cols].sum() / len(labels)
+
+
+class CentroidTracker:
+    """
+    Carries k-means centroids from one frame of a time series to the next (per series and stage),
+    so a frame only needs a short refinement seeded with the previous frame's centroids. A refined fit
+    is rejected, and the frame clustered again from scratch, when its inertia per pixel rises more
+    than `drift` (relative) above the previous frame's.
+    """
+
+    def __init__(self, drift: float = 0.2, refine_iter: int = 20):
+        self.drift = drift
+        self.refine_iter = refine_iter
+        self.previous = {}
+
+    def seed(self, key) -> Optional[np.ndarray]:
+        previous = self.previous.get(key)
+        return None if previous is None else previous[0]
+
+    def keep(self, key, centers: np.ndarray, inertia: float, n_pixels: int) -> bool:
+        _, previous_inertia = self.previous[key]
+        if inertia / n_pixels > previous_inertia * (1 + self.drift):
+            print(f"Inertia drifted from previous frame of {key}, falling back to full restarts")
+            return False
+
+        self.record(key, centers, inertia, n_pixels)
+        return True
+
+    def record(self, key, centers: np.ndarray, inertia: float, n_pixels: int):
+        self.previous[key] = (np.array(centers), inertia / n_pixels)
+
+
+def fit_kmeans(pixels: np.ndarray, n_clusters: int, tracker: CentroidTracker = None, key=None) -> 'KMeans':
+    """
+    Fit k-means with 40 restarts or, given a tracker holding centroids for `key`, a single short
+    refinement from those centroids (see CentroidTracker).
+    """
+    # scikit-learn takes a good part of a second to import and the histogram path doesn't need it
+    from sklearn.cluster import KMeans
+
+    seed = None if tracker is None else tracker.seed(key)
+    if seed is not None:
+        kmeans = KMeans(n_clusters=n_clusters, init=seed, n_init=1, max_iter=tracker.refine_iter).fit(pixels)
+        if tracker.keep(key, kmeans.cluster_centers_, kmeans.inertia_, len(pixels)):
+            return kmeans
+
+    kmeans = KMeans(n_clusters=n_clusters, n_init=40, max_iter=500).fit(pixels)
+    if tracker is not None:
+        tracker.record(key, kmeans.cluster_centers_, kmeans.inertia_, len(pixels))
+    return kmeans
+
+
+def kmeans_image(
+        image: np.ndarray,
+        n_clusters: int,
+        sample_fraction: float = None,
+        sampling: str = 'random',
+        validate: bool = False,
+        tracker: CentroidTracker = None,
+        key=None) -> np.ndarray:
+    """
+    Cluster the pixels of an (h, w, c) image and return an (h, w) uint8 image where each pixel holds
+    its cluster's grey level as assigned by rank_levels.
+
+    Single-channel uint8 images take the histogram path; anything else is clustered pixel by pixel.
+    With a sample fraction, centroids are fitted on a stratified subsample of the pixels (see
+    sample_indices) and every pixel is then assigned to its nearest centroid. To check a sample
+    fraction, `validate` also runs the full fit and reports how closely the two agree. A tracker
+    warm-starts the multi-channel fit from the previous frame of the series identified by `key`; the
+    histogram path is exact and restart-free, so it needs no seeding.
+    """
+    if image.shape[2] == 1 and image.dtype == np.uint8:
+        channel = np.ascontiguousarray(image[:, :, 0])
+        lut, counts = histogram_kmeans(channel, n_clusters)
+        return cv2.LUT(channel, rank_levels(counts, n_clusters)[lut])
+
+    # Flatten the 2D image array into an MxN feature vector, where M is the number of pixels and N is the dimension (number of channels).
+    reshaped = image.reshape(image.shape[0] * image.shape[1], image.shape[2])
+
+    if sample_fraction is None:
+        labels = fit_kmeans(reshaped, n_clusters, tracker, key).labels_
+    else:
+        sample = reshaped[sample_indices(image.shape[0], image.shape[1], sample_fraction, sampling)]
+        kmeans = fit_kmeans(sample, n_clusters, tracker, key)
+        labels = nearest_centroid(reshaped, kmeans.cluster_centers_)
+        print(f"Fitted {n_clusters} centroids on {len(sample)} sampled pixels ({sampling}, fraction {sample_fraction})")
+
+        if validate:
+            from sklearn.cluster import KMeans
+            full = KMeans(n_clusters=n_clusters, n_init=40, max_iter=500).fit(reshaped).labels_
+            print(f"Sampled fit agrees with full fit on {label_agreement(labels, full, n_clusters):.2%} of pixels")
+
+    counts = np.bincount(labels, minlength=n_clusters)
+    return kernels.remap_labels(labels, rank_levels(counts, n_clusters)).reshape(image.shape[:2])
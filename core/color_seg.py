@@ -26,7 +26,8 @@ python3 color_seg.py -p /home/suxing/plant-image-analysis/test/ -ft JPG
 import os
 import glob
 import argparse
-from sklearn.cluster import KMeans
+
+from clustering import kmeans_image
 
 from skimage.feature import peak_local_max
 from skimage.morphology import watershed, medial_axis
@@ -117,10 +118,6 @@ def color_cluster_seg(image, args_colorspace, args_channels, args_num_clusters):
     #print(width, height, n_channel)
     
  
-    # Flatten the 2D image array into an MxN feature vector, where M is the number of pixels and N is the dimension (number of channels).
-    reshaped = image.reshape(image.shape[0] * image.shape[1], image.shape[2])
-    
-
     # Perform K-means clustering.
     if args_num_clusters < 2:
         print('Warning: num-clusters < 2 invalid. Using num-clusters = 2')
@@ -128,22 +125,9 @@ def color_cluster_seg(image, args_colorspace, args_channels, args_num_clusters):
     #define number of cluster
     numClusters = max(2, args_num_clusters)
     
-    # clustering method
-    kmeans = KMeans(n_clusters = numClusters, n_init = 40, max_iter = 500).fit(reshaped)
-    
-    # get lables 
-    pred_label = kmeans.labels_
-    
-    # Reshape result back into a 2D array, where each element represents the corresponding pixel's cluster index (0 to K - 1).
-    clustering = np.reshape(np.array(pred_label, dtype=np.uint8), (image.shape[0], image.shape[1]))
-
-    # Sort the cluster labels in order of the frequency with which they occur.
-    sortedLabels = sorted([n for n in range(numClusters)],key = lambda x: -np.sum(clustering == x))
-
-    # Initialize K-means grayscale image; set pixel colors based on clustering.
-    kmeansImage = np.zeros(image.shape[:2], dtype=np.uint8)
-    for i, label in enumerate(sortedLabels):
-        kmeansImage[clustering == label] = int(255 / (numClusters - 1)) * i
+    # Cluster the pixels (in the histogram domain for a single uint8 channel) and set each pixel to
+    # a grey level given by its cluster's rank in order of the frequency with which they occur.
+    kmeansImage = kmeans_image(image, numClusters)
     
     ret, thresh = cv2.threshold(kmeansImage,0,255,cv2.THRESH_BINARY | cv2.THRESH_OTSU)
     
@@ -181,20 +165,28 @@ def color_cluster_seg(image, args_colorspace, args_channels, args_num_clusters):
     
     max_size = width*height*0.1
     
-    img_thresh = np.zeros([width, height], dtype=np.uint8)
+    #for every component in the image, keep it only if it's above min_size, deciding from the stats alone
+    #and painting the mask with one lookup of the label image
+    centroids_x = centroids[:nb_components, 0]
+    centroids_y = centroids[:nb_components, 1]
     
-    #for every component in the image, keep it only if it's above min_size
-    for i in range(0, nb_components):
+    center = (sizes >= min_size) & (Coord_left > 1) & (Coord_top > 1) & (Coord_width - Coord_left > 0) & (Coord_height - Coord_top > 0) & (centroids_x - width*0.5 < 10) & (centroids_y - height*0.5 < 10) & (sizes <= max_size)
+    
+    near_max = ((Coord_width - Coord_left)*0.5 - width < 15) & (centroids_x - width*0.5 < 15) & (centroids_y - height*0.5 < 15) & (sizes <= max_size)
+    
+    keep = center.copy()
+    
+    if np.any(center):
+        print("Foreground center found ")
         
-        if (sizes[i] >= min_size) and (Coord_left[i] > 1) and (Coord_top[i] > 1) and (Coord_width[i] - Coord_left[i] > 0) and (Coord_height[i] - Coord_top[i] > 0) and (centroids[i][0] - width*0.5 < 10) and ((centroids[i][1] - height*0.5 < 10)) and ((sizes[i] <= max_size)):
-            img_thresh[output == i + 1] = 255
-            
-            print("Foreground center found ")
-            
-        elif ((Coord_width[i] - Coord_left[i])*0.5 - width < 15) and (centroids[i][0] - width*0.5 < 15) and (centroids[i][1] - height*0.5 < 15) and ((sizes[i] <= max_size)):
-            imax = max(enumerate(sizes), key=(lambda x: x[1]))[0] + 1    
-            img_thresh[output == imax] = 255
-            print("Foreground max found ")
+    if np.any(~center & near_max):
+        keep[np.argmax(sizes)] = True
+        print("Foreground max found ")
+    
+    lut = np.zeros(nb_components + 1, dtype=np.uint8)
+    lut[1:][keep] = 255
+    
+    img_thresh = lut[output]
        
     
     #from skimage import img_as_ubyte
@@ -1,47 +1,107 @@
-from scipy import optimize
+from typing import List, Tuple
+
 import numpy as np
 import matplotlib.pyplot as plt
 
 
+def pack_contours(contours: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Concatenate contours (as returned by cv2.findContours) into one ragged (n, 2) array of points,
+    plus the offsets at which each contour starts followed by the total number of points.
+    """
+    lengths = [len(c) for c in contours]
+    if not contours:
+        return np.empty((0, 2)), np.zeros(1, dtype=np.int64)
+    points = np.concatenate([c.reshape(-1, 2) for c in contours]).astype(np.float64)
+    return points, np.concatenate(([0], np.cumsum(lengths)))
+
+
+def fit_circles(points: np.ndarray, offsets: np.ndarray, refine_steps: int = 5) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fit a circle to each segment points[offsets[i]:offsets[i + 1]] of a ragged point array, all segments at once.
+
+    Centers start from the closed-form algebraic (Kasa) fit and are refined by Gauss-Newton steps on the
+    geometric objective, the spread of the point distances around their mean (the same objective the
+    former per-contour scipy.optimize.leastsq fit minimised). For strongly elongated segments that objective
+    keeps decreasing as the radius grows, so, as with leastsq, the refined curvature tends towards 0.
+    Returns the center coordinates and radii; segments whose points are collinear get an infinite radius.
+    """
+    n = len(offsets) - 1
+    counts = np.diff(offsets)
+    segment = np.repeat(np.arange(n), counts)
+
+    def segment_sum(values):
+        return np.bincount(segment, weights=values, minlength=n)
+
+    def segment_mean(values):
+        return segment_sum(values) / counts
+
+    x = points[:, 0]
+    y = points[:, 1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # algebraic fit on coordinates centered per segment
+        x_mean = segment_mean(x)
+        y_mean = segment_mean(y)
+        u = x - x_mean[segment]
+        v = y - y_mean[segment]
+
+        suu, svv, suv = segment_sum(u * u), segment_sum(v * v), segment_sum(u * v)
+        bu = 0.5 * segment_sum(u * (u * u + v * v))
+        bv = 0.5 * segment_sum(v * (u * u + v * v))
+        det = suu * svv - suv * suv
+        xc = x_mean + (bu * svv - bv * suv) / det
+        yc = y_mean + (suu * bv - suv * bu) / det
+
+        # geometric refinement: residuals r_i - mean(r) and their Jacobian w.r.t. the center
+        for _ in range(refine_steps):
+            dx = xc[segment] - x
+            dy = yc[segment] - y
+            ri = np.sqrt(dx * dx + dy * dy)
+            f = ri - segment_mean(ri)[segment]
+            jx = dx / ri
+            jy = dy / ri
+            jx = jx - segment_mean(jx)[segment]
+            jy = jy - segment_mean(jy)[segment]
+
+            jxx, jyy, jxy = segment_sum(jx * jx), segment_sum(jy * jy), segment_sum(jx * jy)
+            gx, gy = segment_sum(jx * f), segment_sum(jy * f)
+            det = jxx * jyy - jxy * jxy
+            step_x = (gx * jyy - gy * jxy) / det
+            step_y = (jxx * gy - jxy * gx) / det
+
+            # leave segments that are already converged (or degenerate) where they are
+            step = np.isfinite(step_x) & np.isfinite(step_y)
+            xc = np.where(step, xc - step_x, xc)
+            yc = np.where(step, yc - step_y, yc)
+
+        dx = xc[segment] - x
+        dy = yc[segment] - y
+        r = segment_mean(np.sqrt(dx * dx + dy * dy))
+
+    r[~np.isfinite(r)] = np.inf
+    return xc, yc, r
+
+
+def contour_curvatures(contours: List[np.ndarray], refine_steps: int = 5) -> np.ndarray:
+    """ curvature (inverse radius of the best-fitting circle) of each contour; 0 for collinear points """
+    points, offsets = pack_contours(contours)
+    _, _, r = fit_circles(points, offsets, refine_steps)
+    return 1 / r
+
+
 class ComputeCurvature:
     def __init__(self):
         """ Initialize some variables """
         self.xc = 0  # X-coordinate of circle center
         self.yc = 0  # Y-coordinate of circle center
         self.r = 0   # Radius of the circle
-        self.xx = np.array([])  # Data points
-        self.yy = np.array([])  # Data points
-
-    def calc_r(self, xc, yc):
-        """ calculate the distance of each 2D points from the center (xc, yc) """
-        return np.sqrt((self.xx-xc)**2 + (self.yy-yc)**2)
-
-    def f(self, c):
-        """ calculate the algebraic distance between the data points and the mean circle centered at c=(xc, yc) """
-        ri = self.calc_r(*c)
-        return ri - ri.mean()
-
-    def df(self, c):
-        """ Jacobian of f_2b
-        The axis corresponding to derivatives must be coherent with the col_deriv option of leastsq"""
-        xc, yc = c
-        df_dc = np.empty((len(c), x.size))
-
-        ri = self.calc_r(xc, yc)
-        df_dc[0] = (xc - x)/ri                   # dR/dxc
-        df_dc[1] = (yc - y)/ri                   # dR/dyc
-        df_dc = df_dc - df_dc.mean(axis=1)[:, np.newaxis]
-        return df_dc
 
     def fit(self, xx, yy):
-        self.xx = xx
-        self.yy = yy
-        center_estimate = np.r_[np.mean(xx), np.mean(yy)]
-        center = optimize.leastsq(self.f, center_estimate, Dfun=self.df, col_deriv=True)[0]
-
-        self.xc, self.yc = center
-        ri = self.calc_r(*center)
-        self.r = ri.mean()
+        points = np.column_stack((xx, yy)).astype(np.float64)
+        xc, yc, r = fit_circles(points, np.array([0, len(points)]))
+
+        self.xc, self.yc, self.r = xc[0], yc[0], r[0]
 
         return 1 / self.r  # Return the curvature
 
@@ -0,0 +1,234 @@
+import hashlib
+import time
+from contextlib import closing
+from datetime import timedelta
+from os.path import join
+from typing import Iterable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from core.cache import ArrayCache
+from core.image_writer import image_writer
+from core.luminous_detection import REDUCED_COLOR, image_enhance, isbright, marker_crop, marker_tracker, write_results_to_csv
+from core.manifest import Manifest
+from core.options import ImageInput
+from core.profiling import ProfileWriter, profiler
+from core.scheduler import MemoryModel, run_scheduled
+from core.results import ImageResult
+from core.trait_extract_parallel import trait_extract, writes_artifacts
+from core.utils import TraitsWriter
+from core.workers import limit_threads, run_image, worker_pool
+
+
+class ExtractionPipeline:
+    """
+    Runs every stage of `spg extract` on one image in memory: luminosity check, marker crop and trait
+    extraction. The input file is decoded exactly once and the array is handed from stage to stage;
+    only the final artifacts (the cropped PNG, optionally enhanced, and the trait extraction outputs,
+    as many as the artifact level asks for) are written. Traits are always measured on the cropped
+    image, never the enhanced one. Instances are picklable, so one can be mapped over a pool.
+    """
+
+    def __init__(
+            self,
+            template: np.ndarray,
+            luminosity_threshold: float = 0.1,
+            enhance: bool = False,
+            warm_start: bool = False,
+            cache: ArrayCache = None,
+            debug: bool = False,
+            marker_positions: dict = None,
+            luminosity_scale: int = 1,
+            artifacts: str = 'debug',
+            image_format: str = None,
+            compression: int = None,
+            writer_threads: int = 0):
+        self.template = template  # grayscale marker template
+        self.luminosity_threshold = luminosity_threshold
+        self.enhance = enhance
+        self.warm_start = warm_start
+        self.cache = cache  # intermediate arrays shared across runs, doesn't change outputs
+        self.debug = debug  # write diagnostic images, e.g. the marker match overlay
+        self.marker_positions = marker_positions  # per camera, from a previous run; None disables marker tracking
+        self.luminosity_scale = luminosity_scale  # > 1 screens luminosity on a 1/scale decode first
+        self.artifacts = artifacts  # images to write besides the traits: 'none', 'summary' or 'debug' (see ARTIFACT_LEVELS)
+        self.image_format = image_format  # format of the images written, None for the input's (see ImageWriter)
+        self.compression = compression  # PNG compression level or JPEG/WebP quality, None for OpenCV's default
+        self.writer_threads = writer_threads  # threads writing images in the background, 0 to write them synchronously
+
+    def parameters(self) -> dict:
+        """ everything that affects this pipeline's outputs, for keying completed images (see Manifest) """
+        return {
+            'template': hashlib.sha1(np.ascontiguousarray(self.template)).hexdigest(),
+            'luminosity_threshold': self.luminosity_threshold,
+            'luminosity_scale': self.luminosity_scale,
+            'enhance': self.enhance,
+            'warm_start': self.warm_start,
+            'artifacts': self.artifacts,
+            'image_format': self.image_format,
+            'compression': self.compression,
+        }
+
+    def __call__(self, options: ImageInput) -> Tuple[tuple, Optional[ImageResult], Optional[Tuple[int, int]], List[dict]]:
+        """
+        process(), followed by the timing and memory use of each of its stages (see core.profiling). Returns
+        once every image it wrote is on disk, so that an image recorded as done has all of its outputs.
+        """
+        image_writer.configure(self.writer_threads, image_format=self.image_format, compression=self.compression)
+        profiler.begin(options.input_name)
+        with profiler.stage('total'):
+            luminosity, result, position = self.process(options)
+            with profiler.stage('write'):
+                image_writer.flush()
+        profiler.note(completed=result is not None and not result.failed)
+        return luminosity, result, position, profiler.end()
+
+    def process(self, options: ImageInput) -> Tuple[tuple, Optional[ImageResult], Optional[Tuple[int, int]]]:
+        """
+        Returns the image's luminosity row (name, normalized luminosity, 'dark' or 'bright'), its
+        traits, or None in place of the traits if the image is too dark to process, and, when tracking
+        markers, the marker's position (or None).
+        """
+        # decode at full size, or at 1/scale first when screening luminosity so that dark images are never
+        # fully decoded (at the cost of a second, full size decode of bright ones)
+        with profiler.stage('decode'):
+            image = cv2.imread(options.input_file, REDUCED_COLOR[self.luminosity_scale])
+        if image is None:
+            print(f"Failed to read {options.input_file}")
+            return (options.input_name, None, None), ImageResult(options.input_stem, True), None
+        profiler.note(pixels=image.shape[0] * image.shape[1] * self.luminosity_scale ** 2)
+
+        # check luminosity
+        with profiler.stage('luminosity'):
+            luminosity = isbright(options, self.luminosity_threshold, image)
+        if luminosity[2] == 'bright' and self.luminosity_scale > 1:
+            # downscaling lowers the peak luminosity more than the mean, so screening only errs towards
+            # bright: confirm on the full resolution image, which is needed from here on anyway
+            with profiler.stage('decode'):
+                image = cv2.imread(options.input_file)
+            with profiler.stage('luminosity'):
+                luminosity = isbright(options, self.luminosity_threshold, image)
+        if luminosity[2] == 'dark':
+            print(f"{options.input_stem} is too dark, skipping")
+            return luminosity, None, None
+
+        # crop, searching near the marker's last position in this camera's frames if tracking
+        print(f"Checking for circle to crop in {options.input_file}")
+        overlay_file = f"{join(options.output_directory, options.input_stem)}_marker.png" if self.debug else None
+        with profiler.stage('marker_crop'):
+            if self.marker_positions is None:
+                cropped = marker_crop(image, self.template, overlay_file)
+                position = None
+            else:
+                cropped = marker_crop(image, self.template, overlay_file, marker_tracker, options.series, self.marker_positions.get(options.series))
+                position = marker_tracker.positions.get(options.series)
+        if cropped.size == 0:
+            print(f"No circle found, nothing to crop")
+        else:
+            image = cropped
+
+        # enhance the PNG written, not the image traits are measured on
+        if (image is cropped or self.enhance) and writes_artifacts(self.artifacts, 'summary'):
+            artifact = image
+            if self.enhance:
+                with profiler.stage('enhance'):
+                    artifact = cv2.cvtColor(np.asarray(image_enhance(image)), cv2.COLOR_RGB2BGR)
+            image_writer.write(f"{join(options.output_directory, options.input_stem)}.png", artifact)
+
+        # extract traits
+        with profiler.stage('trait_extract'):
+            result = trait_extract(options, self.warm_start, image, self.cache, self.artifacts)
+        return luminosity, result, position
+
+
+def default_chunksize(n_images: int, processes: int) -> int:
+    # the chunk size pool.map would pick: about 4 contiguous chunks per process
+    chunksize, extra = divmod(n_images, processes * 4)
+    return max(1, chunksize + (1 if extra else 0))
+
+
+def collect(
+        outputs: Iterable[Tuple[tuple, Optional[ImageResult], Optional[Tuple[int, int]], List[dict]]],
+        images: List[ImageInput],
+        output_directory: str,
+        manifest: Manifest = None,
+        marker_positions: dict = None) -> int:
+    """
+    Write each image's outputs as soon as they arrive: its luminosity row to luminous_detection.csv,
+    its traits to traits.csv (through a single TraitsWriter), the timing and memory use of its stages
+    to profile.jsonl and, given a manifest, its status, followed by a progress line with the
+    throughput so far and the estimated time remaining. Given a dict, also collects the marker
+    position in the latest frame of each camera. Returns the number of images processed.
+    """
+    total = len(images)
+    by_name = {image.input_name: image for image in images}
+    latest = {}  # timestamp of the frame each camera's marker position was taken from
+    done = 0
+    start = time.perf_counter()
+
+    with TraitsWriter(output_directory) as writer, ProfileWriter(output_directory) as profile:
+        for luminosity, result, position, stages in outputs:
+            write_results_to_csv([luminosity], output_directory)
+            if result is not None:
+                writer.write(result)
+            profile.write(stages)
+            if manifest is not None:
+                manifest.record(by_name[luminosity[0]], 'dark' if result is None else 'failed' if result.failed else 'done')
+            if marker_positions is not None and position is not None:
+                # images finish out of order, keep the position in each camera's latest frame
+                image = by_name[luminosity[0]]
+                previous = latest.get(image.series)
+                if image.timestamp is None or previous is None or image.timestamp >= previous:
+                    latest[image.series] = image.timestamp
+                    marker_positions[image.series] = position
+
+            done += 1
+            elapsed = time.perf_counter() - start
+            rate = done / elapsed
+            eta = timedelta(seconds=round((total - done) / rate))
+            print(f"[{done}/{total}] {luminosity[0]} done ({rate:.2f} images/s, {elapsed:.0f}s elapsed, ETA {eta})")
+
+    return done
+
+
+def run_streaming(
+        pipeline: ExtractionPipeline,
+        images: List[ImageInput],
+        output_directory: str,
+        processes: int = 1,
+        chunksize: int = None,
+        manifest: Manifest = None,
+        marker_positions: dict = None,
+        max_memory_mb: float = None,
+        memory_model: MemoryModel = None,
+        threads: int = None,
+        max_tasks_per_child: int = None) -> int:
+    """
+    Run the pipeline over a batch of images, writing results as they finish (see collect). With more
+    than one process, images are handed out by imap_unordered in chunks of `chunksize` consecutive
+    images; by default the chunk size pool.map would use, which keeps consecutive frames of a time
+    series in the same worker for warm-started clustering and marker tracking. Given a memory budget,
+    chunks are scheduled largest first and only while their estimated memory fits (see run_scheduled).
+    Workers load the pipeline once and run with `threads` threads each (by default their share of the
+    cores; a single process is left unlimited unless given threads), and are replaced after
+    `max_tasks_per_child` chunks (see worker_pool). Returns once every image has been written.
+    """
+    if processes == 1:
+        if max_memory_mb is not None:
+            print(f"Ignoring the memory budget of {max_memory_mb:.0f} MB, which only applies to parallel runs")
+        if threads:
+            limit_threads(threads)
+        return collect(map(pipeline, images), images, output_directory, manifest, marker_positions)
+
+    chunksize = chunksize or default_chunksize(len(images), processes)
+    if max_memory_mb is not None:
+        outputs = run_scheduled(pipeline, images, processes, chunksize, max_memory_mb, memory_model, threads, max_tasks_per_child)
+        return collect(outputs, images, output_directory, manifest, marker_positions)
+
+    with closing(worker_pool(pipeline, processes, threads, max_tasks_per_child)) as pool:
+        done = collect(pool.imap_unordered(run_image, images, chunksize=chunksize), images, output_directory, manifest, marker_positions)
+        # let the workers exit normally rather than terminating them, so that they run their finalizers
+        pool.close()
+        pool.join()
+    return done
@@ -0,0 +1,109 @@
+import atexit
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import util
+from os.path import splitext
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+IMAGE_FORMATS = ('png', 'jpg', 'webp')
+
+
+def encode_parameters(extension: str, compression: Optional[int]) -> List[int]:
+    """ cv2.imwrite parameters for a file extension: PNG compression level (0-9) or JPEG/WebP quality (0-100) """
+    if compression is None:
+        return []
+    extension = extension.lower().lstrip('.')
+    if extension == 'png':
+        return [cv2.IMWRITE_PNG_COMPRESSION, compression]
+    if extension in ('jpg', 'jpeg'):
+        return [cv2.IMWRITE_JPEG_QUALITY, compression]
+    if extension == 'webp':
+        return [cv2.IMWRITE_WEBP_QUALITY, compression]
+    return []
+
+
+class ImageWriter:
+    """
+    Writes output images on a pool of background threads, so that encoding them (which releases the
+    GIL) and writing them to disk overlap with the processing that follows. Images are copied when
+    queued, so callers can keep drawing on theirs; at most `queue_mb` megabytes of them (or a single
+    larger image) wait to be written at once, beyond that write() blocks. Given an image format,
+    images are written in it whatever the extension of the path, with the given compression level
+    (PNG) or quality (JPEG, WebP). With no threads, images are written synchronously. Pending images
+    are flushed when the process exits, including pool workers that exit normally.
+    """
+
+    def __init__(self, threads: int = 0, queue_mb: float = 256, image_format: str = None, compression: int = None):
+        self.threads = threads
+        self.queue_mb = queue_mb
+        self.image_format = image_format
+        self.compression = compression
+        self.executor = None
+        self.queued_bytes = 0
+        self.space = threading.Condition()
+        self.pending: List[Future] = []
+
+    def configure(self, threads: int = 0, queue_mb: float = 256, image_format: str = None, compression: int = None):
+        """ change the settings, flushing images queued with the old ones (cheap when nothing changes) """
+        if (threads, queue_mb, image_format, compression) == (self.threads, self.queue_mb, self.image_format, self.compression):
+            return
+        self.close()
+        self.threads, self.queue_mb, self.image_format, self.compression = threads, queue_mb, image_format, compression
+
+    def path(self, path: str) -> str:
+        return path if self.image_format is None else f"{splitext(path)[0]}.{self.image_format}"
+
+    def encode(self, path: str, image: np.ndarray) -> bool:
+        if not cv2.imwrite(path, image, encode_parameters(splitext(path)[1], self.compression)):
+            print(f"Failed to write {path}")
+            return False
+        return True
+
+    def write(self, path: str, image: np.ndarray) -> str:
+        """ queue the image to be written to the path (with the configured format's extension), which is returned """
+        path = self.path(path)
+        if self.threads == 0:
+            self.encode(path, image)
+            return path
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.threads, thread_name_prefix='image-writer')
+            # pool workers don't run atexit handlers, but run multiprocessing finalizers when they exit normally
+            util.Finalize(self, self.close, exitpriority=100)
+            atexit.register(self.close)
+
+        size = image.nbytes
+        with self.space:
+            self.space.wait_for(lambda: self.queued_bytes == 0 or self.queued_bytes + size <= self.queue_mb * 1024 * 1024)
+            self.queued_bytes += size
+        future = self.executor.submit(self.encode, path, np.array(image, copy=True))
+        future.add_done_callback(lambda _: self.release(size))
+        self.pending = [f for f in self.pending if not f.done()] + [future]
+        return path
+
+    def release(self, size: int):
+        with self.space:
+            self.queued_bytes -= size
+            self.space.notify_all()
+
+    def flush(self):
+        """ wait for every queued image to be written """
+        pending, self.pending = self.pending, []
+        for future in pending:
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Failed to write an image: {e}")
+
+    def close(self):
+        self.flush()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+# one per process, configured by the extraction pipeline
+image_writer = ImageWriter()
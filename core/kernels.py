@@ -0,0 +1,116 @@
+"""
+Pixel-level kernels with a compiled (numba, see core.numba_kernels) and a pure NumPy implementation
+each. The compiled kernels are used when numba is installed, unless the SPG_DISABLE_NUMBA environment
+variable is set; both give the same results (see benchmarks/kernels.py). numba is only imported when a
+kernel is first called, and compiled kernels are cached on disk, so only the first run on a machine
+pays for compiling them. The luminosity sum and maximum has no compiled kernel: NumPy's is as fast.
+"""
+
+import os
+from importlib.util import find_spec
+from typing import Tuple
+
+import numpy as np
+from scipy import ndimage
+
+NUMBA = find_spec('numba') is not None and not os.environ.get('SPG_DISABLE_NUMBA')
+
+
+def chunks(n: int) -> int:
+    # blocks of rows processed in parallel, each with its own accumulators
+    return max(1, min(n, 4 * os.cpu_count()))
+
+
+# ------------------------------------------------------------------------------------------- NumPy
+
+
+def nearest_centroid_numpy(pixels: np.ndarray, centers: np.ndarray, chunk_size: int = 1 << 20) -> np.ndarray:
+    centers = centers.astype(np.float32)
+    labels = np.empty(len(pixels), dtype=np.int32)
+    for start in range(0, len(pixels), chunk_size):
+        chunk = pixels[start:start + chunk_size].astype(np.float32)
+        distances = ((chunk[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        labels[start:start + chunk_size] = distances.argmin(axis=1)
+    return labels
+
+
+def remap_labels_numpy(labels: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    return lut[labels]
+
+
+def label_stats_numpy(labels: np.ndarray, n_labels: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    flat = labels.ravel()
+    area = np.bincount(flat, minlength=n_labels + 1)
+    rows, cols = np.indices(labels.shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        centroid = np.stack([np.bincount(flat, rows.ravel(), n_labels + 1), np.bincount(flat, cols.ravel(), n_labels + 1)], axis=1) / area[:, None]
+
+    bbox = np.zeros((n_labels + 1, 4), dtype=np.int64)
+    for index, slices in enumerate(ndimage.find_objects(labels, n_labels), start=1):
+        if slices is not None:
+            bbox[index] = slices[0].start, slices[1].start, slices[0].stop, slices[1].stop
+    if area[0]:
+        background = np.nonzero(labels == 0)
+        bbox[0] = background[0].min(), background[1].min(), background[0].max() + 1, background[1].max() + 1
+    return area, bbox, centroid
+
+
+def double_mad_outliers_numpy(data: np.ndarray, thresh: float) -> np.ndarray:
+    m = np.median(data)
+    abs_dev = np.abs(data - m)
+    left_mad = np.median(abs_dev[data <= m])
+    right_mad = np.median(abs_dev[data >= m])
+    data_mad = left_mad * np.ones(len(data))
+    data_mad[data > m] = right_mad
+    with np.errstate(divide='ignore', invalid='ignore'):
+        modified_z_score = 0.6745 * abs_dev / data_mad
+    modified_z_score[data == m] = 0
+    return modified_z_score > thresh
+
+
+# ------------------------------------------------------------------------------------------- dispatch
+
+
+def nearest_centroid(pixels: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    """ index of the nearest centroid (squared euclidean distance, in float32) of each row of an (n, c) pixel matrix """
+    if NUMBA:
+        from core.numba_kernels import nearest_centroid_numba
+        return nearest_centroid_numba(np.ascontiguousarray(pixels), np.ascontiguousarray(centers, dtype=np.float32))
+    return nearest_centroid_numpy(pixels, centers)
+
+
+def remap_labels(labels: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    """ lut[labels], e.g. cluster labels to grey levels """
+    if NUMBA:
+        from core.numba_kernels import remap_labels_numba
+        return remap_labels_numba(np.ascontiguousarray(labels), np.ascontiguousarray(lut))
+    return remap_labels_numpy(labels, lut)
+
+
+def label_stats(labels: np.ndarray, n_labels: int = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Per label 0..n_labels (by default the largest label) of a non-negative integer label image, from a
+    single pass over it: the number of pixels, the bounding box (first row, first column, last row + 1,
+    last column + 1; zeros for missing labels) and the centroid (row, column; NaN for missing labels).
+    """
+    n_labels = int(labels.max()) if n_labels is None else n_labels
+    if NUMBA:
+        from core.numba_kernels import label_stats_numba
+        return label_stats_numba(np.ascontiguousarray(labels), n_labels, chunks(labels.shape[0]))
+    return label_stats_numpy(labels, n_labels)
+
+
+def sum_max(values: np.ndarray) -> Tuple[int, int]:
+    """ sum and maximum of a non-negative integer array """
+    return int(values.sum(dtype=np.uint64)), int(values.max())
+
+
+def double_mad_outliers(data, thresh: float = 3.5) -> np.ndarray:
+    """ outliers of an asymmetric distribution by their modified z-score from the median absolute deviation of their side of the median """
+    data = np.asarray(data, dtype=np.float64)
+    if data.size == 0:
+        return np.zeros(0, dtype=bool)
+    if NUMBA:
+        from core.numba_kernels import double_mad_outliers_numba
+        return double_mad_outliers_numba(data, thresh)
+    return double_mad_outliers_numpy(data, thresh)
@@ -20,8 +20,11 @@ time python3 luminous_detection.py -p ~/plant-image-analysis/test/ -ft png
 # import necessary packages
 import argparse
 import csv
+import json
+import shutil
+from functools import lru_cache, partial
 from os.path import join
-from typing import List
+from typing import Iterator, List, Optional, Tuple
 
 import cv2
 import numpy as np
@@ -39,19 +42,33 @@ from tabulate import tabulate
 import openpyxl
 
 # Convert it to LAB color space to access the luminous channel which is independent of colors.
+from core.kernels import sum_max
 from core.options import ImageInput
 
 
-def isbright(options: ImageInput, threshold: float):
-    # Load image file
-    orig = cv2.imread(options.input_file)
+# decode flags for reading images at 1/2, 1/4 or 1/8 scale (JPEGs are scaled while decoding)
+REDUCED_COLOR = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
 
-    # Make backup image
-    image = orig.copy()
 
-    # Convert color space to LAB format and extract L channel
-    L, A, B = cv2.split(cv2.cvtColor(image, cv2.COLOR_BGR2LAB))
-    normalized = np.mean(L / np.max(L))
+def normalized_luminosity(image: np.ndarray) -> float:
+    """
+    Mean of the L channel (Lab color space) divided by its maximum, i.e. the mean of L / max(L), from
+    an integer sum of the 8-bit L channel rather than a floating point copy of it, and its maximum, in
+    one pass.
+    """
+    L = cv2.extractChannel(cv2.cvtColor(image, cv2.COLOR_BGR2LAB), 0)
+    total, peak = sum_max(L)
+    if peak == 0:
+        return 0.0
+    return total / (L.size * peak)
+
+
+def isbright(options: ImageInput, threshold: float, image: np.ndarray = None, scale: int = 1):
+    # Load image file (at 1/scale resolution for a quicker check), unless the caller has already decoded it
+    image = cv2.imread(options.input_file, REDUCED_COLOR[scale]) if image is None else image
+
+    # Normalized mean luminosity of the L channel in LAB color space
+    normalized = normalized_luminosity(image)
 
     # Normalize L channel by dividing all pixel values with maximum pixel value
     if normalized > threshold:
@@ -83,6 +100,17 @@ def isbright(options: ImageInput, threshold: float):
     return options.input_name, normalized, text_bool
 
 
+def screen_luminosity(options: List[ImageInput], threshold: float, scale: int = 8, processes: int = None) -> List[tuple]:
+    """
+    Check the luminosity of many images in parallel, each decoded at 1/scale resolution. Returns
+    isbright's (name, normalized luminosity, 'dark' or 'bright') rows in the order of the inputs.
+    """
+    with closing(Pool(processes=processes or psutil.cpu_count())) as pool:
+        results = pool.map(partial(isbright, threshold=threshold, scale=scale), options)
+        pool.terminate()
+    return results
+
+
 def increase_brightness(img, value=150):
     hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
     h, s, v = cv2.split(hsv)
@@ -114,6 +142,8 @@ if __name__ == '__main__':
     ap.add_argument("-p", "--path", required=True, help="path to image file")
     ap.add_argument("-ft", "--filetype", required=True, help="image filetype")
     ap.add_argument("-o", "--output_directory", required=True, help="directory to write output files to")
+    ap.add_argument("-l", "--luminosity_threshold", type=float, default=0.1, help="normalized luminosity under which images are dark")
+    ap.add_argument("-s", "--scale", type=int, default=8, choices=[1, 2, 4, 8], help="decode images at 1/scale resolution")
 
     args = vars(ap.parse_args())
 
@@ -138,9 +168,7 @@ if __name__ == '__main__':
     print("Using {0} cores to perfrom parallel processing... \n".format(int(agents)))
 
     # Create a pool of processes. By default, one is created for each CPU in the machine.
-    with closing(Pool(processes=agents)) as pool:
-        results = pool.map(isbright, options)
-        pool.terminate()
+    results = screen_luminosity(options, args['luminosity_threshold'], args['scale'], agents)
 
     # Output sum table in command window 
     print("Summary: {0} plant images were processed...\n".format(n_images))
@@ -268,109 +296,123 @@ def blend_image(left_image, right_image, left_weight, right_weight):
     return blended
 
 
-# detect dark image and replac them with liner interpolated image
-def check_discard_merge(options: List[ImageInput], replace: bool = False, threshold: float = 0.1):
-    # create and assign index list for dark image
-    idx_dark_imglist = [0] * len(options)
-
-    result_list = []
-
-    for idx, image in enumerate(options):
-        img_name, mean_luminosity, luminosity_str = isbright(image.input_file,
-                                                             threshold)  # luminosity detection, luminosity_str is either 'dark' or 'bright'
-        result_list.append([img_name, mean_luminosity, luminosity_str])
-        idx_dark_imglist[idx] = -1 if luminosity_str == 'dark' else (idx)
-
-    table = tabulate(result_list, headers=['image_file_name', 'luminous_avg', 'dark_or_bright'], tablefmt='orgtbl')
-    print(table + "\n")
-
-    # save dark image detection result as excel file
-    write_results_to_excel(result_list, options[0].output_directory)
-
-    # print(idx_dark_imglist)
-
-    # Finding consecutive occurrences of -1 in an array
-    max_dark_list_length = max(len(list(v)) for g, v in itertools.groupby(idx_dark_imglist))
-
-    # check max dark image sequence length, current method only deal with case with length equals 2
-    # print(max_dark_list_length)
-
-    # find dark image index
-    idx_dark = [i for i, x in enumerate(idx_dark_imglist) if x == -1]
-    idx_light = [i for i, x in enumerate(idx_dark_imglist) if x != -1]
-
-    # print(idx_dark)
-
-    # print(len(idx_dark_imglist))
-
-    # process dark image
-    if len(idx_dark) > 1:
-
-        for idx, value in enumerate(idx_dark):
-
-            # print("current value:{0}".format(value))
-
-            # if dark image appears as the start of image list
-            if value == 0:
-
-                right_image_idx = ((value + 1) if idx_dark_imglist[value + 1] != -1 else (value + 2))
+def blend_run(run: list, left: Optional[tuple], right: Optional[tuple]) -> Iterator[Tuple[ImageInput, tuple, Optional[np.ndarray], bool]]:
+    # replace a run of dark frames with blends of the bright (index, image, options) frames around it, or
+    # copies of the one bright frame on either side of a run at the start or end of the sequence
+    left = left or right
+    right = right or left
+    for index, option, luminosity in run:
+        if left is None:
+            print(f"No bright image to replace {option.input_stem} with")
+            yield option, luminosity, None, False
+            continue
 
-                left_image_idx = right_image_idx
+        (left_weight, right_weight) = blend_weight_calculator(left[0], right[0], index)
+        print("Blending image:{0}, left:{1}, right:{2}, left_weight:{3:.2f}, right_weight:{4:.2f}".format(option.input_stem, left[2].input_stem, right[2].input_stem, left_weight, right_weight))
+        yield option, luminosity, cv2.addWeighted(left[1], left_weight, right[1], right_weight, 0), True
+
+
+def interpolate_dark_frames(options: List[ImageInput], threshold: float = 0.1, scale: int = 1) -> Iterator[Tuple[ImageInput, tuple, Optional[np.ndarray], bool]]:
+    """
+    Walk a (timestamp sorted) sequence of images and yield, in sequence order, each image's options,
+    luminosity row (see isbright), image and whether it is a blend. Dark images are replaced by
+    blends of the nearest bright images before and after them, linearly weighted by position, for
+    dark runs of any length. Every image is decoded once and only the last bright image and the
+    pending dark run (without pixels) are held, so neighbours are never read again. With scale > 1,
+    luminosity is checked on a 1/scale decode first and only bright images are fully decoded.
+    """
+    previous = None
+    pending = []
+
+    for index, option in enumerate(options):
+        image = cv2.imread(option.input_file, REDUCED_COLOR[scale])
+        luminosity = isbright(option, threshold, image)
+        if luminosity[2] == 'bright' and scale > 1:
+            # screening only errs towards bright, confirm at full resolution
+            image = cv2.imread(option.input_file)
+            luminosity = isbright(option, threshold, image)
+
+        if luminosity[2] == 'dark':
+            pending.append((index, option, luminosity))
+            continue
 
-            # if dark image appears as the end of image list
-            elif value == len(idx_dark_imglist) - 1:
+        yield from blend_run(pending, previous, (index, image, option))
+        pending = []
+        previous = (index, image, option)
+        yield option, luminosity, image, False
 
-                left_image_idx = ((value - 1) if idx_dark_imglist[value - 1] != -1 else (value - 2))
+    yield from blend_run(pending, previous, None)
 
-                right_image_idx = left_image_idx
 
-            else:
+# detect dark image and replac them with liner interpolated image
+def check_discard_merge(options: List[ImageInput], replace: bool = False, threshold: float = 0.1, scale: int = 1):
+    any_dark = False
 
-                left_image_idx = ((value - 1) if idx_dark_imglist[value - 1] != -1 else (value - 2))
+    if len(options) == 0:
+        return any_dark
 
-                right_image_idx = ((value + 1) if idx_dark_imglist[value + 1] != -1 else (value + 2))
+    # if every image has timestamp data, sort images by timestamp
+    if all(option.timestamp is not None for option in options):
+        options = sorted(options, key=lambda o: o.timestamp)
 
-            # print("current image idx:{0}, left_idx:{1}, right_idx:{2}\n".format(value, left_image_idx, right_image_idx))
+    result_list = []
+    output_directory = options[0].output_directory
 
-            (left_weight, right_weight) = blend_weight_calculator(left_image_idx, right_image_idx, value)
+    for option, luminosity, image, blended in interpolate_dark_frames(options, threshold, scale):
+        result_list.append(list(luminosity))
+        any_dark = any_dark or luminosity[2] == 'dark'
+        if image is None:
+            continue
 
-            # print("current image idx:{0}, left_idx:{1}, right_idx:{2}, left_weight:{3}, right_weight:{4} \n".format(value, left_image_idx, right_image_idx, left_weight, right_weight))
+        # save result into result folder
+        if blended:
+            cv2.imwrite(join(output_directory, option.input_file) if replace else f"{join(output_directory, option.input_stem)}.blended.png", image)
+        else:
+            cv2.imwrite(join(output_directory, option.input_file) if replace else f"{join(output_directory, option.input_stem)}.png", image)
 
-            blended = blend_image(options[left_image_idx].input_file, options[right_image_idx].input_file, left_weight, right_weight)
+    table = tabulate(result_list, headers=['image_file_name', 'luminous_avg', 'dark_or_bright'], tablefmt='orgtbl')
+    print(table + "\n")
 
-            print("Blending image:{0}, left:{1}, right:{2}, left_weight:{3:.2f}, right_weight:{4:.2f}".format(options[value].input_stem,
-                                                                                                              options[left_image_idx].input_stem,
-                                                                                                              options[right_image_idx].input_stem,
-                                                                                                              left_weight, right_weight))
+    # save dark image detection result as excel file
+    write_results_to_excel(result_list, output_directory)
 
-            # save result by overwriting original files
-            # cv2.imwrite(options[value].input_file, blended)
+    return any_dark
 
-            # save result into result folder for debugging
-            cv2.imwrite(join(options[0].output_directory,
-                             options[value].input_file) if replace else f"{join(options[0].output_directory, options[value].input_stem)}.blended.png",
-                        blended)
 
-    for idx, value in enumerate(idx_light):
-        image = cv2.imread(options[value].input_file)
-        cv2.imwrite(join(options[0].output_directory,
-                         options[value].input_file) if replace else f"{join(options[0].output_directory, options[value].input_stem)}.png", image)
+def copy_input(source: str, destination: str):
+    """
+    copy source to destination (same bytes, no re-encoding). Not a hard link: images written later under
+    the destination's name would overwrite the input in place.
+    """
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        return
+    shutil.copy2(source, destination)
 
 
-def check_discard_merge2(options: List[ImageInput], threshold: float = 0.1):
+def check_discard_merge2(options: List[ImageInput], threshold: float = 0.1, scale: int = 1, processes: int = None):
+    """
+    Check the luminosity of every image on a pool of workers and copy the bright ones to the output
+    directory. A library path: spg extract checks each image's luminosity in its own worker instead,
+    on the image it decodes for trait extraction (see core.extraction).
+    """
     left = None
     right = None
     i = 0
     replaced = 0
     any_dark = False
 
+    if len(options) == 0:
+        return any_dark
+
     # if every image has timestamp data, sort images by timestamp
     if all(option.timestamp is not None for option in options):
         options = sorted(options, key=lambda o: o.timestamp)
 
-    for option in options:
-        img_name, mean_luminosity, luminosity_str = isbright(option, threshold)  # luminosity detection, luminosity_str is either 'dark' or 'bright'
-        write_results_to_csv([(img_name, mean_luminosity, luminosity_str)], option.output_directory)
+    # luminosity detection on a pool of workers, results in input order, luminosity_str is either 'dark' or 'bright'
+    results = screen_luminosity(options, threshold, scale, processes)
+    write_results_to_csv(results, options[0].output_directory)
+
+    for option, (img_name, mean_luminosity, luminosity_str) in zip(options, results):
         if luminosity_str == 'dark':
             print(f"{option.input_stem} is too dark, skipping")
             any_dark = True
@@ -378,7 +420,7 @@ def check_discard_merge2(options: List[ImageInput], threshold: float = 0.1):
         else:
             path = join(options[0].output_directory, Path(option.input_file).name)
             print(f"Writing to {path}")
-            cv2.imwrite(path, cv2.imread(option.input_file))
+            copy_input(option.input_file, path)
         # if luminosity_str == 'dark':
         #     if left is None:
         #         left = i
@@ -413,58 +455,128 @@ def check_discard_merge2(options: List[ImageInput], threshold: float = 0.1):
     return any_dark
 
 
+# Read the (grayscale) marker template, once per process and path
+@lru_cache(maxsize=None)
+def load_template(template_path: str) -> np.ndarray:
+    return cv2.imread(template_path, 0)
+
+
 # Detect circles in the image
 def circle_detect(image_path, template_path):
     print(f"Checking for circle to crop in {image_path}")
-    template = cv2.imread(template_path, 0)
+    template = load_template(template_path)
+
+    # load the image, then crop it
+    return marker_crop(cv2.imread(image_path), template)
+
+
+# Crop the region next to the marker out of an already decoded BGR image (template is grayscale)
+def match_marker(img_gray: np.ndarray, template: np.ndarray, levels: int = 2, threshold: float = 0.8) -> Tuple[int, int, float]:
+    """
+    Locate the template in a grayscale image, coarse to fine: match on both downscaled `levels` times
+    (each pyrDown halves the resolution), then refine at full resolution in a small window around the
+    coarse match. If the refined score is below the threshold (no clear marker, or the marker is too
+    small to survive downscaling), falls back to matching the full-resolution image. Returns the top
+    left corner (x, y) of the best match and its normalized correlation coefficient.
+    """
+    h, w = template.shape
+    scale = 2 ** levels
+
+    if levels > 0 and min(h, w) >= 16 * scale:
+        coarse_gray, coarse_template = img_gray, template
+        for _ in range(levels):
+            coarse_gray, coarse_template = cv2.pyrDown(coarse_gray), cv2.pyrDown(coarse_template)
+
+        res = cv2.matchTemplate(coarse_gray, coarse_template, cv2.TM_CCOEFF_NORMED)
+        (cy, cx) = np.unravel_index(res.argmax(), res.shape)
+
+        # refine within a few coarse pixels of the coarse match
+        margin = 2 * scale
+        x0, y0 = max(cx * scale - margin, 0), max(cy * scale - margin, 0)
+        x1, y1 = min(cx * scale + w + margin, img_gray.shape[1]), min(cy * scale + h + margin, img_gray.shape[0])
+        res = cv2.matchTemplate(img_gray[y0:y1, x0:x1], template, cv2.TM_CCOEFF_NORMED)
+        (y, x) = np.unravel_index(res.argmax(), res.shape)
+        if res[y, x] >= threshold:
+            return x0 + x, y0 + y, float(res[y, x])
 
-    # load the image, clone it for output, and then convert it to grayscale
-    img_ori = cv2.imread(image_path)
+    res = cv2.matchTemplate(img_gray, template, cv2.TM_CCOEFF_NORMED)
+    (y, x) = np.unravel_index(res.argmax(), res.shape)
+    return x, y, float(res[y, x])
 
-    img_rgb = img_ori.copy()
 
-    # Convert it to grayscale
-    img_gray = cv2.cvtColor(img_rgb, cv2.COLOR_BGR2GRAY)
+class MarkerTracker:
+    """
+    Follows the marker through the frames of fixed cameras. Each frame of a camera is first searched in
+    a window `margin` pixels around where the marker was in the camera's previous frame (or where a
+    previous run last saw it, given as a hint), and only if the match there scores below the threshold
+    is the whole frame searched (see match_marker). Holds the last position per camera that matched
+    with at least the threshold's score.
+    """
 
-    # Store width and height of template in w and h
-    w, h = template.shape[::-1]
+    def __init__(self, margin: int = 32, threshold: float = 0.8):
+        self.margin = margin
+        self.threshold = threshold
+        self.positions = {}
 
-    # Perform match operations.
-    res = cv2.matchTemplate(img_gray, template, cv2.TM_CCOEFF_NORMED)
+    def locate(self, img_gray: np.ndarray, template: np.ndarray, camera: str, hint: Tuple[int, int] = None) -> Tuple[int, int, float]:
+        h, w = template.shape
+        previous = self.positions.get(camera, hint)
 
-    # Specify a threshold
-    threshold = 0.8
+        if previous is not None:
+            px, py = previous
+            x0, y0 = max(px - self.margin, 0), max(py - self.margin, 0)
+            x1, y1 = min(px + w + self.margin, img_gray.shape[1]), min(py + h + self.margin, img_gray.shape[0])
+            if x1 - x0 >= w and y1 - y0 >= h:
+                res = cv2.matchTemplate(img_gray[y0:y1, x0:x1], template, cv2.TM_CCOEFF_NORMED)
+                (y, x) = np.unravel_index(res.argmax(), res.shape)
+                if res[y, x] >= self.threshold:
+                    self.positions[camera] = (int(x0 + x), int(y0 + y))
+                    return x0 + x, y0 + y, float(res[y, x])
 
-    # Store the coordinates of matched area in a numpy array
-    loc = np.where(res >= threshold)
+            print(f"Lost track of the marker of {camera}, searching the whole frame")
 
-    if len(loc):
+        # only a clear match is worth searching around in the camera's next frames
+        (x, y, score) = match_marker(img_gray, template, threshold=self.threshold)
+        if score >= self.threshold:
+            self.positions[camera] = (int(x), int(y))
+        return x, y, score
+
+
+# one per process, so that it persists across the images a worker is handed
+marker_tracker = MarkerTracker()
 
-        (y, x) = np.unravel_index(res.argmax(), res.shape)
 
-        (min_val, max_val, min_loc, max_loc) = cv2.minMaxLoc(res)
+def read_marker_positions(path: str) -> dict:
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as file:
+        return {camera: tuple(position) for camera, position in json.load(file).items()}
 
-        # print(y,x)
 
-        # print(min_val, max_val, min_loc, max_loc)
+def write_marker_positions(path: str, positions: dict):
+    with open(path, 'w') as file:
+        json.dump({camera: list(position) for camera, position in positions.items()}, file, indent=2)
 
-        # Draw a rectangle around the matched region.
-        for pt in zip(*loc[::-1]):
-            circle_overlay = cv2.rectangle(img_rgb, pt, (pt[0] + w, pt[1] + h), (0, 255, 255), 2)
 
-            # save segmentation result
-        # result_file = (save_path + base_name + '_circle.' + args['filetype'])
-        # print(result_file)
-        # cv2.imwrite(result_file, circle_overlay)
+def marker_crop(img_ori: np.ndarray, template: np.ndarray, overlay_file: str = None, tracker: MarkerTracker = None, camera: str = None, hint: Tuple[int, int] = None) -> np.ndarray:
+    # Convert it to grayscale
+    img_gray = cv2.cvtColor(img_ori, cv2.COLOR_BGR2GRAY)
+
+    # Locate the marker, near its last known position if tracking the camera's marker
+    if tracker is None:
+        (x, y, score) = match_marker(img_gray, template)
+    else:
+        (x, y, score) = tracker.locate(img_gray, template, camera, hint)
 
-        crop_img = img_rgb[y + 150:y + 850, x - 650:x]
+    # Draw a rectangle around the matched region, only if debug output is requested
+    if overlay_file is not None:
+        h, w = template.shape
+        overlay = cv2.rectangle(img_ori.copy(), (int(x), int(y)), (int(x) + w, int(y) + h), (0, 255, 255), 2)
+        cv2.imwrite(overlay_file, overlay)
 
-        # save segmentation result
-        # result_file = (save_path + base_name + '_cropped.' + args['filetype'])
-        # print(result_file)
-        # cv2.imwrite(result_file, crop_img)
+    crop_img = img_ori[y + 150:y + 850, x - 650:x]
 
-    return crop_img
+    return np.ascontiguousarray(crop_img)
 
 
 def image_enhance(image_file):
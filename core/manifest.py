@@ -0,0 +1,52 @@
+import hashlib
+import json
+import os
+import time
+from os.path import abspath, join
+
+from core.options import ImageInput
+
+
+def parameters_hash(parameters: dict) -> str:
+    return hashlib.sha1(json.dumps(parameters, sort_keys=True).encode()).hexdigest()
+
+
+class Manifest:
+    """
+    Journal of the images an output directory has seen, kept as manifest.jsonl (one JSON object per
+    line, appended and flushed as each image finishes, so it survives crashes and timeouts). An entry
+    is keyed by the input's absolute path, size, modification time and a hash of the run parameters, so
+    an image counts as completed only if neither it nor the parameters changed since. Images whose
+    last status is 'done' or 'dark' are completed; 'failed' ones are retried.
+    """
+
+    COMPLETED = ('done', 'dark')
+
+    def __init__(self, output_directory: str, parameters: dict):
+        self.path = join(output_directory, 'manifest.jsonl')
+        self.parameters = parameters_hash(parameters)
+        self.statuses = {}
+
+        if os.path.isfile(self.path):
+            with open(self.path) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # a line cut short by a crash
+                        continue
+                    self.statuses[(entry['path'], entry['size'], entry['mtime'], entry['parameters'])] = entry['status']
+
+    def key(self, options: ImageInput) -> tuple:
+        stat = os.stat(options.input_file)
+        return abspath(options.input_file), stat.st_size, stat.st_mtime_ns, self.parameters
+
+    def completed(self, options: ImageInput) -> bool:
+        return self.statuses.get(self.key(options)) in Manifest.COMPLETED
+
+    def record(self, options: ImageInput, status: str):
+        key = self.key(options)
+        self.statuses[key] = status
+        path, size, mtime, parameters = key
+        with open(self.path, 'a') as file:
+            file.write(json.dumps({'path': path, 'size': size, 'mtime': mtime, 'parameters': parameters, 'status': status, 'time': time.time()}) + '\n')
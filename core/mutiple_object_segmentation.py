@@ -22,7 +22,8 @@ python3 mutiple_object.py -p /home/suxing/plant-image-analysis/test/ -ft JPG
 import os
 import glob
 import argparse
-from sklearn.cluster import KMeans
+
+from clustering import kmeans_image
 
 from skimage.feature import peak_local_max
 from skimage.morphology import watershed, medial_axis
@@ -113,10 +114,6 @@ def color_cluster_seg(image, args_colorspace, args_channels, args_num_clusters):
     #print(width, height, n_channel)
 
 
-    # Flatten the 2D image array into an MxN feature vector, where M is the number of pixels and N is the dimension (number of channels).
-    reshaped = image.reshape(image.shape[0] * image.shape[1], image.shape[2])
-
-
     # Perform K-means clustering.
     if args_num_clusters < 2:
         print('Warning: num-clusters < 2 invalid. Using num-clusters = 2')
@@ -124,22 +121,9 @@ def color_cluster_seg(image, args_colorspace, args_channels, args_num_clusters):
     #define number of cluster
     numClusters = max(2, args_num_clusters)
 
-    # clustering method
-    kmeans = KMeans(n_clusters = numClusters, n_init = 40, max_iter = 500).fit(reshaped)
-
-    # get lables 
-    pred_label = kmeans.labels_
-
-    # Reshape result back into a 2D array, where each element represents the corresponding pixel's cluster index (0 to K - 1).
-    clustering = np.reshape(np.array(pred_label, dtype=np.uint8), (image.shape[0], image.shape[1]))
-
-    # Sort the cluster labels in order of the frequency with which they occur.
-    sortedLabels = sorted([n for n in range(numClusters)],key = lambda x: -np.sum(clustering == x))
-
-    # Initialize K-means grayscale image; set pixel colors based on clustering.
-    kmeansImage = np.zeros(image.shape[:2], dtype=np.uint8)
-    for i, label in enumerate(sortedLabels):
-        kmeansImage[clustering == label] = int(255 / (numClusters - 1)) * i
+    # Cluster the pixels (in the histogram domain for a single uint8 channel) and set each pixel to
+    # a grey level given by its cluster's rank in order of the frequency with which they occur.
+    kmeansImage = kmeans_image(image, numClusters)
 
     ret, thresh = cv2.threshold(kmeansImage,0,255,cv2.THRESH_BINARY | cv2.THRESH_OTSU)
 
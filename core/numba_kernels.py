@@ -0,0 +1,99 @@
+"""
+The compiled (numba) implementations of core.kernels, in a module of their own so that numba is only
+imported when a kernel is first called. Use them through core.kernels, which falls back to NumPy.
+"""
+
+import numpy as np
+from numba import njit, prange
+
+
+@njit(parallel=True, cache=True)
+def nearest_centroid_numba(pixels, centers):
+    n, c = pixels.shape
+    labels = np.empty(n, dtype=np.int32)
+    for i in prange(n):
+        best = np.inf
+        best_j = 0
+        for j in range(centers.shape[0]):
+            distance = np.float32(0)
+            for k in range(c):
+                difference = np.float32(pixels[i, k]) - centers[j, k]
+                distance += difference * difference
+            if distance < best:
+                best = distance
+                best_j = j
+        labels[i] = best_j
+    return labels
+
+
+@njit(parallel=True, cache=True)
+def remap_labels_numba(labels, lut):
+    flat = labels.ravel()
+    remapped = np.empty(flat.size, dtype=lut.dtype)
+    for i in prange(flat.size):
+        remapped[i] = lut[flat[i]]
+    return remapped.reshape(labels.shape)
+
+
+@njit(parallel=True, cache=True)
+def label_stats_numba(labels, n_labels, n_chunks):
+    h, w = labels.shape
+    step = (h + n_chunks - 1) // n_chunks
+    area = np.zeros((n_chunks, n_labels + 1), dtype=np.int64)
+    row_sum = np.zeros((n_chunks, n_labels + 1))
+    col_sum = np.zeros((n_chunks, n_labels + 1))
+    bbox = np.empty((n_chunks, n_labels + 1, 4), dtype=np.int64)
+    for t in prange(n_chunks):
+        bbox[t, :, 0] = h
+        bbox[t, :, 1] = w
+        bbox[t, :, 2] = 0
+        bbox[t, :, 3] = 0
+        for r in range(t * step, min(h, (t + 1) * step)):
+            for c in range(w):
+                label = labels[r, c]
+                area[t, label] += 1
+                row_sum[t, label] += r
+                col_sum[t, label] += c
+                bbox[t, label, 0] = min(bbox[t, label, 0], r)
+                bbox[t, label, 1] = min(bbox[t, label, 1], c)
+                bbox[t, label, 2] = max(bbox[t, label, 2], r + 1)
+                bbox[t, label, 3] = max(bbox[t, label, 3], c + 1)
+
+    total = np.zeros(n_labels + 1, dtype=np.int64)
+    centroid = np.full((n_labels + 1, 2), np.nan)
+    box = np.zeros((n_labels + 1, 4), dtype=np.int64)
+    for label in range(n_labels + 1):
+        rows = 0.0
+        cols = 0.0
+        box[label, 0] = h
+        box[label, 1] = w
+        for t in range(n_chunks):
+            total[label] += area[t, label]
+            rows += row_sum[t, label]
+            cols += col_sum[t, label]
+            box[label, 0] = min(box[label, 0], bbox[t, label, 0])
+            box[label, 1] = min(box[label, 1], bbox[t, label, 1])
+            box[label, 2] = max(box[label, 2], bbox[t, label, 2])
+            box[label, 3] = max(box[label, 3], bbox[t, label, 3])
+        if total[label] > 0:
+            centroid[label, 0] = rows / total[label]
+            centroid[label, 1] = cols / total[label]
+        else:
+            box[label, :] = 0
+    return total, box, centroid
+
+
+# a few hundred values at most: not worth threads
+@njit(cache=True, error_model='numpy')
+def double_mad_outliers_numba(data, thresh):
+    m = np.median(data)
+    abs_dev = np.abs(data - m)
+    left_mad = np.median(abs_dev[data <= m])
+    right_mad = np.median(abs_dev[data >= m])
+    outliers = np.empty(data.size, dtype=np.bool_)
+    for i in range(data.size):
+        if data[i] == m:
+            outliers[i] = 0.0 > thresh
+        else:
+            outliers[i] = 0.6745 * abs_dev[i] / (right_mad if data[i] > m else left_mad) > thresh
+    return outliers
@@ -18,7 +18,10 @@ class ImageInput:
             minute = int(splt[5])
             second = int(splt[6].split('_')[0])
             self.timestamp = datetime(year, month, day, hour=hour, minute=minute, second=second)
+            # frames of the same camera/plant share their filename apart from the timestamp
+            self.series = '-'.join([splt[3], splt[6].partition('_')[2]] + splt[7:])
             print(f"Parsed timestamp {self.timestamp} from filename: {self.input_name}")
         except:
             self.timestamp = None
+            self.series = self.input_stem
             print(f"No timestamp in filename: {self.input_name}")
@@ -0,0 +1,184 @@
+import json
+import time
+from contextlib import contextmanager
+from functools import wraps
+from os.path import join
+from typing import List
+
+import numpy as np
+import psutil
+
+MB = 1024 * 1024
+
+
+def rss_mb() -> float:
+    return psutil.Process().memory_info().rss / MB
+
+
+def reset_peak_rss() -> bool:
+    """ reset the process' peak RSS to its current RSS (Linux only), returns whether it could """
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb() -> float:
+    """ the process' peak RSS since the last reset_peak_rss (or since it started), its current RSS where that isn't known """
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return rss_mb()
+
+
+class StageProfiler:
+    """
+    Records the wall time, CPU time and peak resident memory of named stages of processing an image.
+    Stages are timed with the stage() context manager, the timed() decorator or matching start() and
+    stop() calls, and can nest. Memory is the peak RSS while the stage ran and how far it rose above the
+    RSS the stage started at. On Linux the kernel's RSS high-water mark is reset at every stage
+    boundary, so each stage's peak is its own (and enclosing stages get the largest peak of the stages
+    they contain); elsewhere, the peak is the largest RSS sampled at the stage's boundaries, which
+    misses short-lived allocations.
+    """
+
+    def __init__(self):
+        self.image = None
+        self.records = []
+        self.fields = {}
+        self.open = []  # peak RSS so far of each stage being timed, innermost last
+        self.started = []  # name, starting RSS, wall and CPU time of each stage being timed, innermost last
+        self.peak_reset = False  # whether the kernel's RSS high-water mark could be reset at the last boundary
+
+    def begin(self, image: str):
+        self.image = image
+        self.records = []
+        self.fields = {}
+
+    def note(self, **fields):
+        """ attributes of the image (e.g. its pixel count) to add to each of its records """
+        self.fields.update(fields)
+
+    def end(self) -> List[dict]:
+        records = [{**record, **self.fields} for record in self.records]
+        self.image = None
+        self.records = []
+        self.fields = {}
+        return records
+
+    def sample(self):
+        # fold the peak since the last boundary into every open stage, and start a new interval
+        peak = max(peak_rss_mb(), rss_mb())
+        self.open = [max(stage, peak) for stage in self.open]
+        self.peak_reset = reset_peak_rss()
+        if self.peak_reset:
+            return rss_mb()
+        return peak
+
+    def start(self, name: str):
+        """ start timing stage `name`, until the matching stop() """
+        start = self.sample()
+        self.open.append(start)
+        self.started.append((name, start, time.perf_counter(), time.process_time()))
+
+    def stop(self):
+        """ stop timing the innermost stage started """
+        name, start, wall, cpu = self.started.pop()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        self.sample()
+        peak = self.open.pop()
+        self.records.append({
+            'image': self.image,
+            'stage': name,
+            'wall': wall,
+            'cpu': cpu,
+            'peak_rss_mb': peak,
+            'rss_growth_mb': peak - start,
+            'peak_reset': self.peak_reset,
+        })
+
+    @contextmanager
+    def stage(self, name: str):
+        depth = len(self.started)
+        self.start(name)
+        try:
+            yield
+        finally:
+            # stages started inside and left open (by an exception between start() and stop()) end here too
+            while len(self.started) > depth:
+                self.stop()
+
+    def timed(self, name: str = None):
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name or function.__name__):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+# one per process, for the image the process is working on
+profiler = StageProfiler()
+
+
+class ProfileWriter:
+    """ Appends stage records to profile.jsonl (one JSON object per line), flushing after each image. """
+
+    def __init__(self, output_directory: str):
+        self.file = open(join(output_directory, 'profile.jsonl'), 'a')
+
+    def write(self, records: List[dict]):
+        for record in records:
+            self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_profile(path: str) -> List[dict]:
+    records = []
+    with open(path) as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # a line cut short by a crash
+                continue
+    return records
+
+
+def summarize_profile(records: List[dict], percentiles=(50, 90, 99)) -> List[list]:
+    """
+    One row per stage, in order of first appearance: number of images, wall time percentiles and
+    mean, share of the total wall time of top-level stages, mean CPU time, CPU / wall time (above 1
+    for multithreaded stages), and the largest peak RSS and RSS growth.
+    """
+    stages = {}
+    for record in records:
+        stages.setdefault(record['stage'], []).append(record)
+
+    total = sum(record['wall'] for record in stages.get('total', records))
+    rows = []
+    for stage, stage_records in stages.items():
+        wall = np.array([record['wall'] for record in stage_records])
+        cpu = np.array([record['cpu'] for record in stage_records])
+        rows.append(
+            [stage, len(stage_records)]
+            + list(np.percentile(wall, percentiles))
+            + [wall.mean(), 100 * wall.sum() / total if total else 0.0, cpu.mean(), cpu.sum() / wall.sum() if wall.sum() else 0.0]
+            + [max(record['peak_rss_mb'] for record in stage_records), max(record['rss_growth_mb'] for record in stage_records)])
+    return rows
@@ -0,0 +1,45 @@
+from typing import Iterator
+
+import cv2
+import numpy as np
+
+from core.kernels import label_stats
+
+
+class Region:
+    def __init__(self, label: int, slices: tuple, mask: np.ndarray, contour: np.ndarray, area: int, centroid: tuple):
+        self.label = label
+        self.slices = slices  # (rows, columns) slices of the bounding box, for indexing full-size images
+        self.mask = mask  # uint8 mask (0 or 255) of the region, cropped to its bounding box
+        self.contour = contour  # largest external contour, in full-image coordinates
+        self.area = area  # number of pixels
+        self.centroid = centroid  # (row, column) mean of the region's pixel coordinates
+
+    @property
+    def bbox(self):
+        """ bounding box as (x, y, width, height), like cv2.boundingRect """
+        rows, cols = self.slices
+        return cols.start, rows.start, cols.stop - cols.start, rows.stop - rows.start
+
+
+def label_regions(labels: np.ndarray) -> Iterator[Region]:
+    """
+    Yield a Region for every nonzero label of a label image (e.g. watershed output), in label order.
+
+    Areas, bounding boxes and centroids of all labels come from a single pass (see label_stats), so
+    each region's mask and contour are computed on its crop rather than on a full-size mask per label.
+    """
+    areas, bboxes, centroids = label_stats(labels)
+    for index in range(1, len(areas)):
+        # labels without any pixels have no bounding box
+        if areas[index] == 0:
+            continue
+
+        top, left, bottom, right = bboxes[index]
+        slices = (slice(int(top), int(bottom)), slice(int(left), int(right)))
+        mask = (labels[slices] == index).astype(np.uint8) * 255
+        offset = (slices[1].start, slices[0].start)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
+        contour = max(contours, key=cv2.contourArea)
+
+        yield Region(index, slices, mask, contour, int(areas[index]), tuple(centroids[index]))
@@ -0,0 +1,129 @@
+import queue
+from contextlib import closing
+from typing import Callable, Iterator, List
+
+import numpy as np
+from PIL import Image
+
+from core.options import ImageInput
+from core.workers import run_images, worker_pool
+
+
+def image_pixels(path: str) -> int:
+    """ pixel count of an image file, from its header (nothing is decoded), or 0 if it can't be read """
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+        return width * height
+    except OSError:
+        return 0
+
+
+class MemoryModel:
+    """
+    Estimates the peak memory of extracting traits from an image as `image_mb + mb_per_megapixel` per
+    megapixel, on top of the `worker_mb` every worker process holds (interpreter, libraries, template).
+    The defaults were measured with the instrumentation (core.profiling) on frames processed whole,
+    without a marker to crop to, which is the worst case. calibrate() refits them to a previous run.
+    """
+
+    def __init__(self, worker_mb: float = 350, image_mb: float = 125, mb_per_megapixel: float = 25):
+        self.worker_mb = worker_mb
+        self.image_mb = image_mb
+        self.mb_per_megapixel = mb_per_megapixel
+
+    def estimate(self, pixels: int) -> float:
+        return self.image_mb + self.mb_per_megapixel * pixels / 1e6
+
+    def calibrate(self, records: List[dict], margin: float = 1.25) -> 'MemoryModel':
+        """
+        A model fitted to the profile records (see core.profiling) of a previous run: a line through the
+        peak memory each image needed above the RSS its processing started at against its megapixels,
+        raised to lie above every point, and as the memory of a worker the largest RSS a worker started
+        an image at (which includes what it keeps from earlier images, not only the libraries it starts
+        with), all with a safety margin. Only images whose traits were extracted count, as dark and
+        failed ones stop early, and only peaks measured with the kernel's high-water mark reset at
+        every stage (Linux), as the others miss short-lived allocations. Without such records, this
+        model.
+        """
+        measured = [record for record in records if record.get('peak_reset')]
+        if records and not measured:
+            print("The previous run's memory peaks were only sampled at stage boundaries, not calibrating the memory model to them")
+            return self
+
+        points = np.array([(record['pixels'] / 1e6, record['rss_growth_mb']) for record in measured if record['stage'] == 'total' and record.get('completed') and record.get('pixels')])
+        if len(points) == 0:
+            return self
+
+        slope = self.mb_per_megapixel
+        if len(np.unique(points[:, 0])) > 1:
+            slope = max(0.0, float(np.polyfit(points[:, 0], points[:, 1], 1)[0]))
+        offset = max(0.0, float(np.max(points[:, 1] - slope * points[:, 0])))
+
+        # the RSS at the start of each image's decode, its first stage
+        baselines = [record['peak_rss_mb'] - record['rss_growth_mb'] for record in measured if record['stage'] == 'decode']
+        worker_mb = max(baselines) if baselines else self.worker_mb
+
+        return MemoryModel(worker_mb * margin, offset * margin, slope * margin)
+
+
+def run_scheduled(
+        pipeline: Callable,
+        images: List[ImageInput],
+        processes: int,
+        chunksize: int,
+        max_memory_mb: float,
+        model: MemoryModel = None,
+        threads: int = None,
+        max_tasks_per_child: int = None) -> Iterator:
+    """
+    Run the pipeline over chunks of `chunksize` consecutive images in a pool, yielding outputs as chunks
+    finish, while the estimated memory of the workers and of the chunks being processed (a chunk
+    needs as much as its largest image, see MemoryModel) stays under `max_memory_mb`. Chunks are
+    started largest first, so the longest ones don't trail at the end; chunks of the same size keep
+    their order. The pool has as many processes as the budget allows for the smallest chunks, up to
+    `processes`. A chunk too large for the budget on its own is run alone. Workers are set up as by
+    worker_pool.
+    """
+    model = model or MemoryModel()
+    chunks = [images[start:start + chunksize] for start in range(0, len(images), chunksize)]
+    if not chunks:
+        return
+    estimates = [max(model.estimate(image_pixels(image.input_file)) for image in chunk) for chunk in chunks]
+    pending = sorted(range(len(chunks)), key=lambda index: -estimates[index])
+
+    processes = max(1, min(processes, len(chunks), int(max_memory_mb // (model.worker_mb + min(estimates)))))
+    print(f"Scheduling {len(chunks)} chunks of up to {chunksize} images on {processes} processes within {max_memory_mb:.0f} MB "
+          f"(estimated {min(estimates):.0f} to {max(estimates):.0f} MB per chunk, {model.worker_mb:.0f} MB per process)")
+
+    finished = queue.Queue()
+    with closing(worker_pool(pipeline, processes, threads, max_tasks_per_child)) as pool:
+        running = {}
+        while pending or running:
+            # start the largest chunks that fit
+            for index in list(pending):
+                if len(running) == processes:
+                    break
+                if running and processes * model.worker_mb + sum(running.values()) + estimates[index] > max_memory_mb:
+                    continue
+                if not running and processes * model.worker_mb + estimates[index] > max_memory_mb:
+                    print(f"Chunk of {len(chunks[index])} images needs an estimated {estimates[index]:.0f} MB, more than the budget allows, running it alone")
+                pending.remove(index)
+                running[index] = estimates[index]
+                pool.apply_async(
+                    run_images,
+                    (chunks[index],),
+                    callback=lambda outputs, index=index: finished.put((index, outputs)),
+                    error_callback=lambda error, index=index: finished.put((index, error)))
+
+            index, outputs = finished.get()
+            del running[index]
+            if isinstance(outputs, BaseException):
+                # stop the other chunks rather than leaving them running
+                pool.terminate()
+                raise outputs
+            yield from outputs
+
+        # let the workers exit normally rather than terminating them, so that they run their finalizers
+        pool.close()
+        pool.join()
@@ -1,6 +1,16 @@
+from functools import lru_cache
+from typing import Tuple
+
 import numpy as np
 import cv2
 
+
+@lru_cache(maxsize=None)
+def clahe(clip_limit: float = 3.0, tile_grid_size: Tuple[int, int] = (8, 8)) -> cv2.CLAHE:
+    """ a CLAHE instance per setting, created once per process and reused for every image """
+    return cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid_size)
+
+
 def simple_threshold(image: np.ndarray, threshold: int = 90, invert: bool = False) -> np.ndarray:
     if threshold < 0 or threshold > 255:
         raise ValueError(f"Threshold must be between 0 and 255")
@@ -30,6 +40,6 @@ def adaptive_threshold_gaussian(image: np.ndarray, invert: bool = False) -> np.n
 
 
 def otsu_threshold(image: np.ndarray, invert: bool = False) -> np.ndarray:
-    image = cv2.createCLAHE(clipLimit=3).apply(image)
+    image = clahe().apply(image)
     _, image = cv2.threshold(image, 0, 255, (cv2.THRESH_BINARY_INV if invert else cv2.THRESH_BINARY) + cv2.THRESH_OTSU)
     return image
\ No newline at end of file
@@ -26,7 +26,6 @@ import glob
 import os
 import traceback
 import warnings
-from collections import Counter
 from os.path import join
 from typing import List
 
@@ -36,8 +35,6 @@ import matplotlib.pyplot as plt
 import numpy as np
 import openpyxl
 from scipy import ndimage
-from scipy import optimize
-from scipy.interpolate import interp1d
 from scipy.spatial import distance as dist
 from skan import Skeleton, summarize, draw
 from skimage import img_as_float, img_as_ubyte, img_as_bool
@@ -45,11 +42,17 @@ from skimage import morphology
 from skimage.color import rgb2lab, deltaE_cie76
 from skimage.feature import peak_local_max
 from skimage.segmentation import clear_border, watershed
-from sklearn.cluster import KMeans
 from tabulate import tabulate
 
-from core.luminous_detection import isbright, write_results_to_csv
+from core.cache import ArrayCache, cached, content_hash
+from core.clustering import CentroidTracker, kmeans_image, nearest_centroid
+from core.curvature import contour_curvatures
+from core.luminous_detection import interpolate_dark_frames, write_results_to_csv
+from core.image_writer import image_writer
+from core.kernels import double_mad_outliers, label_stats
 from core.options import ImageInput
+from core.profiling import profiler
+from core.regions import label_regions
 from core.results import ImageResult
 from core.thresholding import otsu_threshold
 
@@ -59,50 +62,17 @@ from pathlib import Path
 
 MBFACTOR = float(1<<20)
 
-class ComputeCurvature:
+# centroids of the previous frame of each time series seen by this process, for warm-started clustering
+centroid_tracker = CentroidTracker()
 
-    def __init__(self,x,y):
-        """ Initialize some variables """
-        self.xc = 0  # X-coordinate of circle center
-        self.yc = 0  # Y-coordinate of circle center
-        self.r = 0   # Radius of the circle
-        self.xx = np.array([])  # Data points
-        self.yy = np.array([])  # Data points
-        self.x = x  # X-coordinate of circle center
-        self.y = y  # Y-coordinate of circle center
+# which images trait extraction draws and writes besides the traits: none; summary, one image per
+# stage (segmentation, skeleton, labels, curvature, external contour); or debug, everything
+ARTIFACT_LEVELS = ('none', 'summary', 'debug')
 
-    def calc_r(self, xc, yc):
-        """ calculate the distance of each 2D points from the center (xc, yc) """
-        return np.sqrt((self.xx-xc)**2 + (self.yy-yc)**2)
 
-    def f(self, c):
-        """ calculate the algebraic distance between the data points and the mean circle centered at c=(xc, yc) """
-        ri = self.calc_r(*c)
-        return ri - ri.mean()
-
-    def df(self, c):
-        """ Jacobian of f_2b
-        The axis corresponding to derivatives must be coherent with the col_deriv option of leastsq"""
-        xc, yc = c
-        df_dc = np.empty((len(c), self.x.size))
-
-        ri = self.calc_r(xc, yc)
-        df_dc[0] = (xc - self.x)/ri                   # dR/dxc
-        df_dc[1] = (yc - self.y)/ri                   # dR/dyc
-        df_dc = df_dc - df_dc.mean(axis=1)[:, np.newaxis]
-        return df_dc
-
-    def fit(self, xx, yy):
-        self.xx = xx
-        self.yy = yy
-        center_estimate = np.r_[np.mean(xx), np.mean(yy)]
-        center = optimize.leastsq(self.f, center_estimate, Dfun=self.df, col_deriv=True)[0]
-
-        self.xc, self.yc = center
-        ri = self.calc_r(*center)
-        self.r = ri.mean()
-
-        return 1 / self.r  # Return the curvature
+def writes_artifacts(artifacts: str, level: str) -> bool:
+    """ whether images of the given level are drawn and written at the `artifacts` level """
+    return ARTIFACT_LEVELS.index(artifacts) >= ARTIFACT_LEVELS.index(level)
 
 
 # generate foloder to store the output results
@@ -131,7 +101,68 @@ def mkdir(path):
         return False
         
 
-def color_cluster_seg(image, args_colorspace, args_channels, args_num_clusters):
+# keep the connected components of a binary mask that belong to the plant
+def filter_components(thresh):
+    
+    (width, height) = thresh.shape
+    
+    nb_components, output, stats, centroids = cv2.connectedComponentsWithStats(thresh, connectivity = 8)
+    
+    # stats[0], centroids[0] are for the background label. ignore
+    # cv2.CC_STAT_LEFT, cv2.CC_STAT_TOP, cv2.CC_STAT_WIDTH, cv2.CC_STAT_HEIGHT
+    sizes = stats[1:, cv2.CC_STAT_AREA]
+    
+    Coord_left = stats[1:, cv2.CC_STAT_LEFT]
+    
+    Coord_top = stats[1:, cv2.CC_STAT_TOP]
+    
+    Coord_width = stats[1:, cv2.CC_STAT_WIDTH]
+    
+    Coord_height = stats[1:, cv2.CC_STAT_HEIGHT]
+    
+    Coord_centroids = centroids
+    
+    #print("Coord_centroids {}\n".format(centroids[1][1]))
+    
+    #print("[width, height] {} {}\n".format(width, height))
+    
+    nb_components = nb_components - 1
+    
+    min_size = 1000 
+    
+    max_size = width*height*0.1
+    
+    # Decide which components to keep from their stats alone, then paint the mask with a single
+    # lookup of the label image instead of one full-image scan per component.
+    # (centroids still hold the background in row 0 and are indexed as the selection rules always have)
+    centroids_x = centroids[:nb_components, 0]
+    centroids_y = centroids[:nb_components, 1]
+    
+    large = sizes >= min_size
+    
+    center = (Coord_left > 1) & (Coord_top > 1) & (Coord_width - Coord_left > 0) & (Coord_height - Coord_top > 0) & (centroids_x - width*0.5 < 10) & (centroids_y - height*0.5 < 10)
+    
+    near_max = ((Coord_width - Coord_left)*0.5 - width < 15) & (centroids_x - width*0.5 < 15) & (centroids_y - height*0.5 < 15) & (sizes <= max_size)
+    
+    keep = large & (center | ~near_max)
+    
+    if np.any(large & center):
+        print("Foreground center found ")
+    
+    # a component close to the center but not matching it selects the largest component instead
+    if np.any(large & ~center & near_max):
+        keep[np.argmax(sizes)] = True
+        print("Foreground max found ")
+    
+    lut = np.zeros(nb_components + 1, dtype=np.uint8)
+    lut[1:][keep] = 255
+    
+    img_thresh = lut[output]
+    
+    return img_thresh
+
+
+def color_cluster_seg(image, args_colorspace, args_channels, args_num_clusters, sample_fraction=None, sampling='random', tracker=None, series=None, validate=False):
     
     # Change image color space, if necessary.
     colorSpace = args_colorspace.lower()
@@ -165,33 +196,16 @@ def color_cluster_seg(image, args_colorspace, args_channels, args_num_clusters):
     #print(width, height, n_channel)
     
  
-    # Flatten the 2D image array into an MxN feature vector, where M is the number of pixels and N is the dimension (number of channels).
-    reshaped = image.reshape(image.shape[0] * image.shape[1], image.shape[2])
-    
-
     # Perform K-means clustering.
     if args_num_clusters < 2:
         print('Warning: num-clusters < 2 invalid. Using num-clusters = 2')
     
     #define number of cluster
     numClusters = max(2, args_num_clusters)
-
-    # clustering method
-    kmeans = KMeans(n_clusters = numClusters, n_init = 40, max_iter = 500).fit(reshaped)
-    
-    # get lables 
-    pred_label = kmeans.labels_
     
-    # Reshape result back into a 2D array, where each element represents the corresponding pixel's cluster index (0 to K - 1).
-    clustering = np.reshape(np.array(pred_label, dtype=np.uint8), (image.shape[0], image.shape[1]))
-
-    # Sort the cluster labels in order of the frequency with which they occur.
-    sortedLabels = sorted([n for n in range(numClusters)],key = lambda x: -np.sum(clustering == x))
-
-    # Initialize K-means grayscale image; set pixel colors based on clustering.
-    kmeansImage = np.zeros(image.shape[:2], dtype=np.uint8)
-    for i, label in enumerate(sortedLabels):
-        kmeansImage[clustering == label] = int(255 / (numClusters - 1)) * i
+    # Cluster the pixels (in the histogram domain for a single uint8 channel) and set each pixel to
+    # a grey level given by its cluster's rank in order of the frequency with which they occur.
+    kmeansImage = kmeans_image(image, numClusters, sample_fraction, sampling, validate, tracker=tracker, key=(series, 'color_cluster_seg'))
 
     thresh = otsu_threshold(kmeansImage)
 
@@ -214,50 +228,7 @@ def color_cluster_seg(image, args_colorspace, args_channels, args_num_clusters):
     else:
         thresh_cleaned_bw = thresh
         
-    nb_components, output, stats, centroids = cv2.connectedComponentsWithStats(thresh_cleaned_bw, connectivity = 8)
-    
-    # stats[0], centroids[0] are for the background label. ignore
-    # cv2.CC_STAT_LEFT, cv2.CC_STAT_TOP, cv2.CC_STAT_WIDTH, cv2.CC_STAT_HEIGHT
-    sizes = stats[1:, cv2.CC_STAT_AREA]
-    
-    Coord_left = stats[1:, cv2.CC_STAT_LEFT]
-    
-    Coord_top = stats[1:, cv2.CC_STAT_TOP]
-    
-    Coord_width = stats[1:, cv2.CC_STAT_WIDTH]
-    
-    Coord_height = stats[1:, cv2.CC_STAT_HEIGHT]
-    
-    Coord_centroids = centroids
-    
-    #print("Coord_centroids {}\n".format(centroids[1][1]))
-    
-    #print("[width, height] {} {}\n".format(width, height))
-    
-    nb_components = nb_components - 1
-    
-    min_size = 1000 
-    
-    max_size = width*height*0.1
-    
-    img_thresh = np.zeros([width, height], dtype=np.uint8)
-    
-    
-    for i in range(0, nb_components):
-        
-        if (sizes[i] >= min_size):
-            
-            if (Coord_left[i] > 1) and (Coord_top[i] > 1) and (Coord_width[i] - Coord_left[i] > 0) and (Coord_height[i] - Coord_top[i] > 0) and (centroids[i][0] - width*0.5 < 10) and (centroids[i][1] - height*0.5 < 10):
-                img_thresh[output == i + 1] = 255
-                print("Foreground center found ")
-            
-            elif ((Coord_width[i] - Coord_left[i])*0.5 - width < 15) and (centroids[i][0] - width*0.5 < 15) and (centroids[i][1] - height*0.5 < 15) and ((sizes[i] <= max_size)):
-                imax = max(enumerate(sizes), key=(lambda x: x[1]))[0] + 1    
-                img_thresh[output == imax] = 255
-                print("Foreground max found ")
-            
-            else:
-                img_thresh[output == i + 1] = 255
+    img_thresh = filter_components(thresh_cleaned_bw)
     
     #from skimage import img_as_ubyte
     
@@ -323,25 +294,24 @@ def watershed_seg(orig, thresh, min_distance_value):
 
 
 def individual_object_seg(orig, labels, save_path, base_name, file_extension, leaf_images: bool = True):
-    (width, height, n_channel) = orig.shape
     
-    for label in np.unique(labels):
-    # if the label is zero, we are examining the 'background'
-    # so simply ignore it
-        if label == 0:
-            continue
-     
-        # otherwise, allocate memory for the label region and draw
-        # it on the mask
-        mask = np.zeros((width, height), dtype="uint8")
-        mask[labels == label] = 255
+    # the leaf images are all this produces
+    if not leaf_images:
+        return
+
+    # one black frame, reused for every leaf: only its bounding box is drawn, and cleared once written
+    # (the writer copies the images it queues)
+    masked = np.zeros_like(orig)
+
+    # loop over the labeled regions (the background is not one of them)
+    for region in label_regions(labels):
         
-        # apply individual object mask
-        masked = cv2.bitwise_and(orig, orig, mask = mask)
+        # apply individual object mask within the region's bounding box
+        masked[region.slices] = cv2.bitwise_and(orig[region.slices], orig[region.slices], mask = region.mask)
         
-        if leaf_images:
-            result_img_path = (save_path + base_name + '_leaf_' + str(label) + file_extension)
-            cv2.imwrite(result_img_path, masked)
+        result_img_path = (save_path + base_name + '_leaf_' + str(region.label) + file_extension)
+        image_writer.write(result_img_path, masked)
+        masked[region.slices] = 0
         
 
 
@@ -389,8 +359,11 @@ def watershed_seg_marker(orig, thresh, min_distance_value, img_marker):
 '''
 
 
-def comp_external_contour(orig,thresh):
+def comp_external_contour(orig, thresh, draw: bool = True):
     
+    # trait_img stays None when not drawing
+    trait_img = None
+
     #find contours and get the external one
     contours, hier = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
    
@@ -405,16 +378,16 @@ def comp_external_contour(orig,thresh):
         
         if w>img_width*0.01 and h>img_height*0.01:
             
-            trait_img = cv2.drawContours(orig, contours, -1, (255, 255, 0), 1)
+            if draw:
+                trait_img = cv2.drawContours(orig, contours, -1, (255, 255, 0), 1)
     
-            # draw a green rectangle to visualize the bounding rect
-            roi = orig[y:y+h, x:x+w]
-            
             print("ROI {} detected ...\n".format(index))
             #result_file = (save_path +  str(index) + file_extension)
             #cv2.imwrite(result_file, roi)
             
-            trait_img = cv2.rectangle(orig, (x, y), (x+w, y+h), (255, 255, 0), 3)
+            # draw a green rectangle to visualize the bounding rect
+            if draw:
+                trait_img = cv2.rectangle(orig, (x, y), (x+w, y+h), (255, 255, 0), 3)
             
             index+= 1
 
@@ -430,7 +403,8 @@ def comp_external_contour(orig,thresh):
              # get convex hull
             hull = cv2.convexHull(c)
             # draw it in red color
-            trait_img = cv2.drawContours(orig, [hull], -1, (0, 0, 255), 3)
+            if draw:
+                trait_img = cv2.drawContours(orig, [hull], -1, (0, 0, 255), 3)
             
             '''
             # calculate epsilon base on contour's perimeter
@@ -470,18 +444,20 @@ def comp_external_contour(orig,thresh):
             extTop = tuple(c[c[:,:,1].argmin()][0])
             extBot = tuple(c[c[:,:,1].argmax()][0])
             
-            trait_img = cv2.circle(orig, extLeft, 3, (255, 0, 0), -1)
-            trait_img = cv2.circle(orig, extRight, 3, (255, 0, 0), -1)
-            trait_img = cv2.circle(orig, extTop, 3, (255, 0, 0), -1)
-            trait_img = cv2.circle(orig, extBot, 3, (255, 0, 0), -1)
+            if draw:
+                trait_img = cv2.circle(orig, extLeft, 3, (255, 0, 0), -1)
+                trait_img = cv2.circle(orig, extRight, 3, (255, 0, 0), -1)
+                trait_img = cv2.circle(orig, extTop, 3, (255, 0, 0), -1)
+                trait_img = cv2.circle(orig, extBot, 3, (255, 0, 0), -1)
             
             max_width = dist.euclidean(extLeft, extRight)
             max_height = dist.euclidean(extTop, extBot)
             
-            if max_width > max_height:
-                trait_img = cv2.line(orig, extLeft, extRight, (0,255,0), 2)
-            else:
-                trait_img = cv2.line(orig, extTop, extBot, (0,255,0), 2)
+            if draw:
+                if max_width > max_height:
+                    trait_img = cv2.line(orig, extLeft, extRight, (0,255,0), 2)
+                else:
+                    trait_img = cv2.line(orig, extTop, extBot, (0,255,0), 2)
 
             print("Width and height are {0:.2f},{1:.2f}... \n".format(w, h))
             
@@ -491,60 +467,49 @@ def comp_external_contour(orig,thresh):
     
     
 
-def compute_curv(orig, labels):
+def compute_curv(orig, labels, draw: bool = True):
     
-    gray = cv2.cvtColor(orig, cv2.COLOR_BGR2GRAY)
-    
-    curv_sum = 0.0
-    count = 0
+    # label_trait stays None when not drawing
+    label_trait = None
+    # contours to fit circles to, all at once after the loop
+    leaf_contours = []
     # curvature computation
-    # loop over the unique labels returned by the Watershed algorithm
-    for index, label in enumerate(np.unique(labels), start = 1):
-        # if the label is zero, we are examining the 'background'
-        # so simply ignore it
-        if label == 0:
-            continue
+    # loop over the regions returned by the Watershed algorithm (the background is not one of them)
+    for region in label_regions(labels):
+        label = region.label
      
-        # otherwise, allocate memory for the label region and draw
-        # it on the mask
-        mask = np.zeros(gray.shape, dtype = "uint8")
-        mask[labels == label] = 255
-     
-        # detect contours in the mask and grab the largest one
-        #cnts = cv2.findContours(mask.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
-        contours, hierarchy = cv2.findContours(mask.copy(),cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-        c = max(contours, key = cv2.contourArea)
+        # the largest contour of the region
+        c = region.contour
         
         # draw a circle enclosing the object
-        ((x, y), r) = cv2.minEnclosingCircle(c)
-        label_trait = cv2.circle(orig, (int(x), int(y)), 3, (0, 255, 0), 2)
-        label_trait = cv2.putText(orig, "#{}".format(label), (int(x) - 10, int(y)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
+        if draw:
+            ((x, y), r) = cv2.minEnclosingCircle(c)
+            label_trait = cv2.circle(orig, (int(x), int(y)), 3, (0, 255, 0), 2)
+            label_trait = cv2.putText(orig, "#{}".format(label), (int(x) - 10, int(y)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
         #cv2.putText(orig, "#{}".format(curvature), (int(x) - 10, int(y)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
         
         
         if len(c) >= 5 :
             try:
-                label_trait = cv2.drawContours(orig, [c], -1, (255, 0, 0), 2)
+                if draw:
+                    label_trait = cv2.drawContours(orig, [c], -1, (255, 0, 0), 2)
+                # fitting the ellipse also filters out contours it fails on, so it is done even when not drawing
                 ellipse = cv2.fitEllipse(c)
-                label_trait = cv2.ellipse(orig,ellipse,(0,255,0),2)
-
-                c_np = np.vstack(c).squeeze()
-                count+=1
-
-                x = c_np[:,0]
-                y = c_np[:,1]
+                if draw:
+                    label_trait = cv2.ellipse(orig,ellipse,(0,255,0),2)
 
-                comp_curv = ComputeCurvature(x, y)
-                curvature = comp_curv.fit(x, y)
-
-                curv_sum = curv_sum + curvature
+                leaf_contours.append(c)
             except:
                 print(traceback.format_exc())
         else:
             # optional to "delete" the small contours
-            label_trait = cv2.drawContours(orig, [c], -1, (0, 0, 255), 2)
+            if draw:
+                label_trait = cv2.drawContours(orig, [c], -1, (0, 0, 255), 2)
             print("lack of enough points to fit ellipse")
     
+    curv_sum = float(np.sum(contour_curvatures(leaf_contours)))
+    count = len(leaf_contours)
+    
     if count > 0:
         print('average curvature = {0:.2f}\n'.format(curv_sum/count))
     else:
@@ -604,9 +569,7 @@ def color_quantization(image, mask, save_path, num_clusters):
     cv2.imwrite(result_img_path,quant)
 
     #Get colors and analze them from masked image
-    counts = Counter(labels)
-    # sort to ensure correct color percentage
-    counts = dict(sorted(counts.items()))
+    counts = dict(zip(*np.unique(labels, return_counts = True)))
     
     center_colors = clt.cluster_centers_
     
@@ -679,174 +642,120 @@ def get_cmap(n, name='hsv'):
     
     
 
-def color_region(image, mask, output_directory, file_name, num_clusters):
-    
-    # read the image
-     #grab image width and height
-    (h, w) = image.shape[:2]
+def color_region(image, mask, output_directory, file_name, num_clusters, tracker=None, series=None, artifacts: str = 'debug'):
+    """
+    Cluster the colors of the plant, the pixels of the image under the mask, with K-means in RGB into
+    num_clusters - 1 clusters (num_clusters counts the background as one, which is left out of the
+    clustering). Returns the clusters' center colors in cluster order, leaving out empty clusters. For
+    debugging, also writes the masked and clustered images, each cluster's pixels with their contours,
+    and a pie chart of the clusters' sizes.
+    """
+    debug = writes_artifacts(artifacts, 'debug')
 
     #apply the mask to get the segmentation of plant
-    masked_image_ori = cv2.bitwise_and(image, image, mask = mask)
-    
-    #define result path for labeled images
-    result_img_path = join(output_directory, f"{file_name}.masked.png")
-    cv2.imwrite(result_img_path, masked_image_ori)
-    
-    # convert to RGB
-    image_RGB = cv2.cvtColor(masked_image_ori, cv2.COLOR_BGR2RGB)
+    if debug:
+        masked_image_ori = cv2.bitwise_and(image, image, mask = mask)
+        image_writer.write(join(output_directory, f"{file_name}.masked.png"), masked_image_ori)
 
-    # reshape the image to a 2D array of pixels and 3 color values (RGB)
-    pixel_values = image_RGB.reshape((-1, 3))
-    
-    # convert to float
-    pixel_values = np.float32(pixel_values)
+    # only the plant's pixels are clustered, as float RGB values
+    foreground = np.flatnonzero(mask.reshape(-1))
+    pixel_values = np.ascontiguousarray(image.reshape((-1, 3))[foreground, ::-1], dtype=np.float32)
+
+    # cv2.kmeans reads a single (1, 3) row as three 1D samples, so a lone pixel isn't clustered either
+    num_plant_clusters = min(num_clusters - 1, len(pixel_values))
+    if num_plant_clusters < 1 or len(foreground) < 2:
+        print("No plant pixels to cluster")
+        return []
 
     # define stopping criteria
     criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100, 0.2)
 
-    # number of clusters (K)
-    #num_clusters = 5
-    compactness, labels, (centers) = cv2.kmeans(pixel_values, num_clusters, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
+    # in a time series, refine the previous frame's centers with a single short attempt
+    key = (series, 'color_region')
+    seed = None if tracker is None else tracker.seed(key)
+    if seed is not None and len(seed) == num_plant_clusters:
+        initial_labels = nearest_centroid(pixel_values, seed).reshape((-1, 1))
+        refine_criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, tracker.refine_iter, 0.2)
+        compactness, labels, (centers) = cv2.kmeans(pixel_values, num_plant_clusters, initial_labels, refine_criteria, 1, cv2.KMEANS_USE_INITIAL_LABELS)
+        if not tracker.keep(key, centers, compactness, len(pixel_values)):
+            seed = None
+    else:
+        seed = None
+
+    if seed is None:
+        compactness, labels, (centers) = cv2.kmeans(pixel_values, num_plant_clusters, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
+        if tracker is not None:
+            tracker.record(key, centers, compactness, len(pixel_values))
 
     # convert back to 8 bit values
     centers = np.uint8(centers)
 
-    # flatten the labels array
-    labels_flat = labels.flatten()
+    # flatten the labels array, one label per plant pixel
+    labels_flat = labels.flatten()[:len(foreground)]
 
-    # convert all pixels to the color of the centroids
-    segmented_image = centers[labels_flat]
+    # pixels per cluster
+    counts = np.bincount(labels_flat, minlength = num_plant_clusters)
 
-    # reshape back to the original image dimension
-    segmented_image = segmented_image.reshape(image_RGB.shape)
+    # clusters in order, without empty ones
+    rgb_colors = [center for center, count in zip(centers, counts) if count > 0]
 
+    if not debug:
+        return rgb_colors
 
-    segmented_image_BRG = cv2.cvtColor(segmented_image, cv2.COLOR_RGB2BGR)
-    #define result path for labeled images
-    result_img_path = join(output_directory, f"{file_name}.clustered.png")
-    cv2.imwrite(result_img_path, segmented_image_BRG)
+    centers_BGR = np.ascontiguousarray(centers[:, ::-1])
 
+    # one label image (-1 off the plant) that every cluster's mask is taken from
+    label_image = np.full(mask.size, -1, dtype = np.int32)
+    label_image[foreground] = labels_flat
+    label_image = label_image.reshape(mask.shape[:2])
 
-    '''
-    fig = plt.figure()
-    ax = Axes3D(fig)        
-    for label, pix in zip(labels, segmented_image):
-        ax.scatter(pix[0], pix[1], pix[2], color = (centers))
-            
-    result_file = (save_path + base_name + 'color_cluster_distributation.png')
-    plt.savefig(result_file)
-    '''
-    #Show only one chosen cluster 
-    #masked_image = np.copy(image)
-    masked_image = np.zeros_like(image_RGB)
-
-    # convert to the shape of a vector of pixel values
-    masked_image = masked_image.reshape((-1, 3))
-    # color (i.e cluster) to render
-    #cluster = 2
-
-    cmap = get_cmap(num_clusters+1)
-    
-    #clrs = sns.color_palette('husl', n_colors = num_clusters)  # a list of RGB tuples
+    # convert all plant pixels to the color of their cluster's center
+    segmented_image = np.zeros_like(image).reshape((-1, 3))
+    segmented_image[foreground] = centers_BGR[labels_flat]
+    image_writer.write(join(output_directory, f"{file_name}.clustered.png"), segmented_image.reshape(image.shape))
 
-    color_conversion = interp1d([0,1],[0,255])
+    # bounding box of each cluster (label cluster + 1, 0 off the plant), so that each cluster's mask
+    # and drawing only cover its box
+    _, boxes, _ = label_stats(label_image + 1, num_plant_clusters)
 
+    # one white frame, reused for every cluster and whitened again around its box once written
+    result = np.full_like(image, 255)
 
-    for cluster in range(num_clusters):
+    for cluster in range(num_plant_clusters):
 
         print("Processing Cluster{0} ...\n".format(cluster))
-        #print(clrs[cluster])
-        #print(color_conversion(clrs[cluster]))
 
-        masked_image[labels_flat == cluster] = centers[cluster]
+        top, left, bottom, right = (int(v) for v in boxes[cluster + 1])
+        box = (slice(top, bottom), slice(left, right))
+        cluster_mask = np.uint8(label_image[box] == cluster)
 
-        #print(centers[cluster])
-
-        #convert back to original shape
-        masked_image_rp = masked_image.reshape(image_RGB.shape)
-
-        #masked_image_BRG = cv2.cvtColor(masked_image, cv2.COLOR_RGB2BGR)
-        #cv2.imwrite('maksed.png', masked_image_BRG)
-
-        gray = cv2.cvtColor(masked_image_rp, cv2.COLOR_BGR2GRAY)
-
-        # threshold the image, then perform a series of erosions +
-        # dilations to remove any small regions of noise
-        thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY)[1]
-
-        #thresh_cleaned = clear_border(thresh)
-
-        cnts = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        cnts = cv2.findContours(cluster_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset = (left, top))
         cnts = imutils.grab_contours(cnts)
-        #c = max(cnts, key=cv2.contourArea)
 
-        '''
-        # compute the center of the contour area and draw a circle representing the center
-        M = cv2.moments(c)
-        cX = int(M["m10"] / M["m00"])
-        cY = int(M["m01"] / M["m00"])
-        # draw the countour number on the image
-        result = cv2.putText(masked_image_rp, "#{}".format(cluster + 1), (cX - 20, cY), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255), 2)
-        '''
-        
-        
         if not cnts:
             print("findContours is empty")
-        else:
-            
-            # loop over the (unsorted) contours and draw them
-            for (i, c) in enumerate(cnts):
-
-                result = cv2.drawContours(masked_image_rp, c, -1, color_conversion(np.random.random(3)), 2)
-                #result = cv2.drawContours(masked_image_rp, c, -1, color_conversion(clrs[cluster]), 2)
-
-            #result = result(np.where(result == 0)== 255)
-            result[result == 0] = 255
+            continue
 
+        # the cluster's pixels in its color on white, with each contour drawn in a random color
+        result[box][cluster_mask > 0] = centers_BGR[cluster]
+        for c in cnts:
+            cv2.drawContours(result, [c], -1, (np.random.random(3) * 255).tolist(), 2)
 
-            result_BRG = cv2.cvtColor(result, cv2.COLOR_RGB2BGR)
-            result_img_path = join(output_directory, f"{file_name}.result.{cluster}.png")
-            cv2.imwrite(result_img_path, result_BRG)
+        image_writer.write(join(output_directory, f"{file_name}.result.{cluster}.png"), result)
 
+        # contours are drawn 2 pixels wide, centered on the box's edge pixels
+        result[max(0, top - 2):bottom + 2, max(0, left - 2):right + 2] = 255
 
-    
-    counts = Counter(labels_flat)
-    # sort to ensure correct color percentage
-    counts = dict(sorted(counts.items()))
-    
-    center_colors = centers
+    hex_colors = [RGB2HEX(color) for color in rgb_colors]
 
-    # We get ordered colors by iterating through the keys
-    ordered_colors = [center_colors[i] for i in counts.keys()]
-    hex_colors = [RGB2HEX(ordered_colors[i]) for i in counts.keys()]
-    rgb_colors = [ordered_colors[i] for i in counts.keys()]
-
-    #print(hex_colors)
-    
-    index_bkg = [index for index in range(len(hex_colors)) if hex_colors[index] == '#000000']
-    
-    #print(index_bkg[0])
-
-    #print(counts)
-    #remove background color 
-    del hex_colors[index_bkg[0]]
-    del rgb_colors[index_bkg[0]]
-    
-    # Using dictionary comprehension to find list 
-    # keys having value . 
-    delete = [key for key in counts if key == index_bkg[0]] 
-  
-    # delete the key 
-    for key in delete: del counts[key] 
-   
     fig = plt.figure(figsize = (6, 6))
-    plt.pie(counts.values(), labels = hex_colors, colors = hex_colors)
+    plt.pie(counts[counts > 0], labels = hex_colors, colors = hex_colors)
 
     #define result path for labeled images
     result_img_path = join(output_directory, f"{file_name}.pie_color.png")
     plt.savefig(result_img_path)
+    plt.close(fig)
 
-   
     return rgb_colors
 
 
@@ -920,15 +829,7 @@ def outlier_doubleMAD(data,thresh = 3.5):
     # warning: this function does not check for NAs
     # nor does it address issues when 
     # more than 50% of your data have identical values
-    m = np.median(data)
-    abs_dev = np.abs(data - m)
-    left_mad = np.median(abs_dev[data <= m])
-    right_mad = np.median(abs_dev[data >= m])
-    data_mad = left_mad * np.ones(len(data))
-    data_mad[data > m] = right_mad
-    modified_z_score = 0.6745 * abs_dev / data_mad
-    modified_z_score[data == m] = 0
-    return modified_z_score > thresh
+    return double_mad_outliers(data, thresh)
 
 
 
@@ -978,7 +879,7 @@ def extract_traits(image_file):
     args_num_clusters = args['num_clusters']
     
     #color clustering based plant object segmentation
-    thresh = color_cluster_seg(orig, args_colorspace, args_channels, args_num_clusters)
+    thresh = color_cluster_seg(orig, args_colorspace, args_channels, args_num_clusters, args['sample_fraction'], args['sampling'], validate=args['validate'])
     
     # save segmentation result
     result_file = (save_path + base_name + '_seg' + file_extension)
@@ -992,22 +893,24 @@ def extract_traits(image_file):
     #rgb_colors = color_quantization(image, thresh, save_path, num_clusters)
     rgb_colors = color_region(orig, thresh, save_path, filename, num_clusters)
     
-    selected_color = rgb2lab(np.uint8(np.asarray([[rgb_colors[0]]])))
-    
-    print("Color difference are : ") 
-    
-    print(selected_color)
-    
-    color_diff = []
-    
-    for index, value in enumerate(rgb_colors): 
-        #print(index, value) 
-        curr_color = rgb2lab(np.uint8(np.asarray([[value]])))
-        diff = deltaE_cie76(selected_color, curr_color)
+    # color differences to the first cluster, if there are any plant pixels
+    if rgb_colors:
+        selected_color = rgb2lab(np.uint8(np.asarray([[rgb_colors[0]]])))
         
-        color_diff.append(diff)
+        print("Color difference are : ") 
         
-        print(index, value, diff) 
+        print(selected_color)
+        
+        color_diff = []
+        
+        for index, value in enumerate(rgb_colors): 
+            #print(index, value) 
+            curr_color = rgb2lab(np.uint8(np.asarray([[value]])))
+            diff = deltaE_cie76(selected_color, curr_color)
+            
+            color_diff.append(diff)
+            
+            print(index, value, diff) 
     
     
     
@@ -1141,50 +1044,31 @@ def extract_traits(image_file):
     return image_file_name, area, solidity, max_width, max_height, avg_curv, n_leaves
 
 
-def check_discard_merge(options: List[ImageInput]):
-    left = None
-    right = None
-    i = 0
+def check_discard_merge(options: List[ImageInput], threshold: float = 0.1):
     replaced = 0
     any_dark = False
+    results = []
     sorted_options = sorted(options, key=lambda o: o.timestamp)
-    for option in sorted_options:
-        img_name, mean_luminosity, luminosity_str = isbright(option)  # luminosity detection, luminosity_str is either 'dark' or 'bright'
-        write_results_to_csv([(img_name, mean_luminosity, luminosity_str)], option.output_directory)
-        if luminosity_str == 'dark':
-            if left is None:
-                left = i
-            right = i
+    for option, luminosity, image, blended in interpolate_dark_frames(sorted_options, threshold):
+        results.append(luminosity)  # luminosity detection, luminosity[2] is either 'dark' or 'bright'
+        if luminosity[2] == 'dark':
             any_dark = True
-        elif left is not None and left != right:
-            ii = 0
-            left_file = sorted_options[left].input_file
-            right_file = sorted_options[right].input_file
-            prev_file = sorted_options[left - 1].input_file
-            next_file = sorted_options[right + 1].input_file
-            prev = cv2.imread(prev_file)
-            next = cv2.imread(next_file)
-            width = right - left + 1
-            offset = (1 / width)
-            print(f"Replacing {left_file} to {right_file} with merger of {prev_file} and {next_file}")
-            for opt in reversed(sorted_options[left:right + 1]):
-                prev_weight = ((ii / (right - left)) * ((width - 1) / width)) + offset
-                next_weight = ((1 - prev_weight) * ((width - 1) / width)) + offset
-                print(f"Merging {prev_file} (weight {round(prev_weight, 2)}) with {next_file} (weight: {round(next_weight, 2)})")
-                blended = cv2.addWeighted(prev, prev_weight, next, next_weight, 0)
-                cv2.imwrite(opt.input_file, blended)
-                cv2.imwrite(join(opt.output_directory, f"{opt.input_stem}.blended.png"), blended)
-                ii += 1
-            left = None
-            right = None
-            replaced += width
-        i += 1
+        if blended:
+            cv2.imwrite(option.input_file, image)
+            cv2.imwrite(join(option.output_directory, f"{option.input_stem}.blended.png"), image)
+            replaced += 1
+    if results:
+        write_results_to_csv(results, sorted_options[0].output_directory)
     print(f"Replaced {replaced} dark images with weighted blends of adjacent images")
     return any_dark
 
 
-def trait_extract(options: ImageInput) -> ImageResult:
+def trait_extract(options: ImageInput, warm_start: bool = False, image: np.ndarray = None, cache: ArrayCache = None, artifacts: str = 'debug') -> ImageResult:
     try:
+        # images below the requested artifact level are neither drawn nor encoded
+        summary = writes_artifacts(artifacts, 'summary')
+        debug = writes_artifacts(artifacts, 'debug')
+
         _, file_extension = os.path.splitext(options.input_file)
         file_size = os.path.getsize(options.input_file) / MBFACTOR
 
@@ -1196,47 +1080,67 @@ def trait_extract(options: ImageInput) -> ImageResult:
         args_channels = '1'
         args_num_clusters = 2
 
-        image = cv2.imread(options.input_file)
+        # warm-start clustering from the previous frame of this image's time series
+        tracker = centroid_tracker if warm_start else None
+
+        # decode the input file, unless the caller passes the (already decoded and possibly cropped) image
+        if image is None:
+            image = cv2.imread(options.input_file)
 
         # circle detection
         # _, circles, cropped = circle_detect(options)
         image_copy = image.copy()
 
+        # with a cache, stages are keyed by the image's contents and their parameters and reused across runs
+        image_hash = content_hash(image_copy) if cache is not None else None
+        segmentation = (image_hash, args_colorspace, args_channels, args_num_clusters, warm_start)
+
         # color clustering based plant object segmentation
-        segmented = color_cluster_seg(image_copy, args_colorspace, args_channels, args_num_clusters)
-        cv2.imwrite(join(options.output_directory, f"{options.input_stem}_seg{file_extension}"), segmented)
+        profiler.start('color_cluster_seg')
+        # a warm-started clustering always runs, so that the tracker sees every frame of the series
+        segmented = cached(cache if tracker is None else None, 'color_cluster_seg', segmentation, lambda: color_cluster_seg(image_copy, args_colorspace, args_channels, args_num_clusters, tracker=tracker, series=options.series))
+        if summary:
+            image_writer.write(join(options.output_directory, f"{options.input_stem}_seg{file_extension}"), segmented)
+        profiler.stop()
 
         num_clusters = 5
         # save color quantization result
         # rgb_colors = color_quantization(image, thresh, save_path, num_clusters)
-        rgb_colors = color_region(image_copy, segmented, options.output_directory + '/', options.input_stem, num_clusters)
+        profiler.start('color_region')
+        rgb_colors = color_region(image_copy, segmented, options.output_directory + '/', options.input_stem, num_clusters, tracker, options.series, artifacts)
 
-        selected_color = rgb2lab(np.uint8(np.asarray([[rgb_colors[0]]])))
+        # color differences to the first cluster, if there are any plant pixels
+        if rgb_colors:
+            selected_color = rgb2lab(np.uint8(np.asarray([[rgb_colors[0]]])))
 
-        print("Color difference are : ")
+            print("Color difference are : ")
 
-        print(selected_color)
+            print(selected_color)
 
-        color_diff = []
+            color_diff = []
 
-        for index, value in enumerate(rgb_colors):
-            # print(index, value)
-            curr_color = rgb2lab(np.uint8(np.asarray([[value]])))
-            diff = deltaE_cie76(selected_color, curr_color)
+            for index, value in enumerate(rgb_colors):
+                # print(index, value)
+                curr_color = rgb2lab(np.uint8(np.asarray([[value]])))
+                diff = deltaE_cie76(selected_color, curr_color)
 
-            color_diff.append(diff)
+                color_diff.append(diff)
 
-            print(index, value, diff)
+                print(index, value, diff)
 
             ###############################################
+        profiler.stop()
 
         # accquire medial axis of segmentation mask
         # image_medial_axis = medial_axis_image(thresh)
 
-        image_skeleton, skeleton = skeleton_bw(segmented)
+        profiler.start('skeleton_bw')
+        image_skeleton = cached(cache, 'skeleton_bw', segmentation, lambda: skeleton_bw(segmented)[0])
 
         # save _skeleton result
-        cv2.imwrite(join(options.output_directory, f"{options.input_stem}_skeleton{file_extension}"), img_as_ubyte(image_skeleton))
+        if summary:
+            image_writer.write(join(options.output_directory, f"{options.input_stem}_skeleton{file_extension}"), img_as_ubyte(image_skeleton))
+        profiler.stop()
 
         ###
         # ['skeleton-id', 'node-id-src', 'node-id-dst', 'branch-distance',
@@ -1246,6 +1150,7 @@ def trait_extract(options: ImageInput) -> ImageResult:
         ###
 
         # get brach data
+        profiler.start('summarize')
         branch_data = summarize(Skeleton(image_skeleton))
         # print(branch_data)
 
@@ -1293,55 +1198,73 @@ def trait_extract(options: ImageInput) -> ImageResult:
         # print(branch_type_list.count(1))
 
         print("[INFO] {} branch end points found\n".format(branch_type_list.count(1)))
+        profiler.stop()
 
         # img_hist = branch_data.hist(column = 'branch-distance', by = 'branch-type', bins = 100)
         # result_file = (save_path + base_name + '_hist' + file_extension)
         # plt.savefig(result_file, transparent = True, bbox_inches = 'tight', pad_inches = 0)
         # plt.close()
 
-        fig = plt.plot()
-        source_image = cv2.cvtColor(image_copy, cv2.COLOR_BGR2RGB)
-        # img_overlay = draw.overlay_euclidean_skeleton_2d(source_image, branch_data, skeleton_color_source = 'branch-distance', skeleton_colormap = 'hsv')
-        img_overlay = draw.overlay_euclidean_skeleton_2d(source_image, branch_data, skeleton_color_source='branch-type', skeleton_colormap='hsv')
-        plt.savefig(join(options.output_directory, f"{options.input_stem}_euclidean_graph_overlay{file_extension}"), transparent=True, bbox_inches='tight', pad_inches=0)
-        plt.close()
+        if debug:
+            profiler.start('euclidean_graph_overlay')
+            fig = plt.plot()
+            source_image = cv2.cvtColor(image_copy, cv2.COLOR_BGR2RGB)
+            # img_overlay = draw.overlay_euclidean_skeleton_2d(source_image, branch_data, skeleton_color_source = 'branch-distance', skeleton_colormap = 'hsv')
+            img_overlay = draw.overlay_euclidean_skeleton_2d(source_image, branch_data, skeleton_color_source='branch-type', skeleton_colormap='hsv')
+            plt.savefig(join(options.output_directory, f"{options.input_stem}_euclidean_graph_overlay{file_extension}"), transparent=True, bbox_inches='tight', pad_inches=0)
+            plt.close()
+            profiler.stop()
 
         ############################################## leaf number computation
         min_distance_value = 20
         # watershed based leaf area segmentaiton
-        labels = watershed_seg(image_copy, segmented, min_distance_value)
+        profiler.start('watershed_seg')
+        labels = cached(cache, 'watershed_seg', segmentation + (min_distance_value,), lambda: watershed_seg(image_copy, segmented, min_distance_value))
+        profiler.stop()
 
         # labels = watershed_seg_marker(orig, thresh, min_distance_value, img_marker)
 
-        individual_object_seg(image_copy, labels, options.output_directory + '/', options.input_stem, file_extension)
+        profiler.start('individual_object_seg')
+        individual_object_seg(image_copy, labels, options.output_directory + '/', options.input_stem, file_extension, leaf_images=debug)
+        profiler.stop()
 
         # save watershed result label image
         # Map component labels to hue val
-        label_hue = np.uint8(128 * labels / np.max(labels))
-        # label_hue[labels == largest_label] = np.uint8(15)
-        blank_ch = 255 * np.ones_like(label_hue)
-        labeled_img = cv2.merge([label_hue, blank_ch, blank_ch])
+        if summary:
+            profiler.start('label_image')
+            label_hue = np.uint8(128 * labels / np.max(labels))
+            # label_hue[labels == largest_label] = np.uint8(15)
+            blank_ch = 255 * np.ones_like(label_hue)
+            labeled_img = cv2.merge([label_hue, blank_ch, blank_ch])
 
-        # cvt to BGR for display
-        labeled_img = cv2.cvtColor(labeled_img, cv2.COLOR_HSV2BGR)
+            # cvt to BGR for display
+            labeled_img = cv2.cvtColor(labeled_img, cv2.COLOR_HSV2BGR)
 
-        # set background label to black
-        labeled_img[label_hue == 0] = 0
-        # plt.imsave(result_file, img_as_float(labels), cmap = "Spectral")
-        cv2.imwrite(join(options.output_directory, f"{options.input_stem}_label{file_extension}"), labeled_img)
+            # set background label to black
+            labeled_img[label_hue == 0] = 0
+            # plt.imsave(result_file, img_as_float(labels), cmap = "Spectral")
+            image_writer.write(join(options.output_directory, f"{options.input_stem}_label{file_extension}"), labeled_img)
+            profiler.stop()
 
-        (avg_curv, label_trait) = compute_curv(image_copy, labels)
+        profiler.start('compute_curv')
+        (avg_curv, label_trait) = compute_curv(image_copy, labels, draw=summary)
 
         # save watershed result label image
-        cv2.imwrite(join(options.output_directory, f"{options.input_stem}_curv{file_extension}"), label_trait)
+        if summary:
+            image_writer.write(join(options.output_directory, f"{options.input_stem}_curv{file_extension}"), label_trait)
+        profiler.stop()
 
         # find external contour
-        (trait_img, area, solidity, max_width, max_height) = comp_external_contour(image_copy, segmented)
+        profiler.start('comp_external_contour')
+        (trait_img, area, solidity, max_width, max_height) = comp_external_contour(image_copy, segmented, draw=summary)
         # save segmentation result
         # print(filename)
-        cv2.imwrite(join(options.output_directory, f"{options.input_stem}_excontour{file_extension}"), trait_img)
+        if summary:
+            image_writer.write(join(options.output_directory, f"{options.input_stem}_excontour{file_extension}"), trait_img)
+        profiler.stop()
 
-        n_leaves = int(len(np.unique(labels)) / 1 - 1)
+        # distinct labels, the background included, less one
+        n_leaves = int(np.count_nonzero(label_stats(labels)[0]) - 1)
 
         # print("[INFO] {} n_leaves found\n".format(len(np.unique(labels)) - 1))
 
@@ -1364,6 +1287,9 @@ if __name__ == '__main__':
                                                                        + ' 1 is the second channel, etc. E.g., if BGR color space is used, "02" ' 
                                                                        + 'selects channels B and R. (default "all")')
     ap.add_argument('-n', '--num-clusters', type = int, default = 2,  help = 'Number of clusters for K-means clustering (default 2, min 2).')
+    ap.add_argument('-sf', '--sample-fraction', type = float, default = None, help = 'Fit multi-channel K-means centroids on this fraction of the pixels, e.g. 0.02 (default: all pixels).')
+    ap.add_argument('-sm', '--sampling', type = str, default = 'random', help = 'How to subsample pixels for K-means: random (stratified, default) or grid.')
+    ap.add_argument('-v', '--validate', action = 'store_true', help = 'With a sample fraction, also run the full K-means fit and report how closely the sampled fit agrees with it.')
     args = vars(ap.parse_args())
 
 
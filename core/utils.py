@@ -15,6 +15,7 @@ import utils
 
 # import the necessary packages
 import csv
+import os
 from os.path import join
 from typing import List
 
@@ -28,24 +29,71 @@ from tabulate import tabulate
 from core.results import ImageResult
 
 
-def write_results(output_directory: str, results: List[ImageResult]):
-    headers = ['filename', 'failed', 'area', 'solidity', 'max_width', 'max_height', 'avg_curv', 'n_leaves']
-    results = [(result.id, result.failed, result.area, result.solidity, result.max_width, result.max_height, result.avg_curve, result.n_leaves) for result in results]
-    table = tabulate(results, headers=headers, tablefmt='orgtbl')
-    print(table)
+TRAITS_HEADERS = ['filename', 'failed', 'area', 'solidity', 'max_width', 'max_height', 'avg_curv', 'n_leaves']
+
+
+def result_row(result: ImageResult) -> tuple:
+    return result.id, result.failed, result.area, result.solidity, result.max_width, result.max_height, result.avg_curve, result.n_leaves
+
+
+class TraitsWriter:
+    """
+    Appends results to traits.csv one row at a time through a single open file, flushing after each
+    row so that everything written survives a crash. Writes the header if the file is new or empty.
+    """
+
+    def __init__(self, output_directory: str):
+        self.file = open(join(output_directory, 'traits.csv'), 'a', newline='')
+        self.writer = csv.writer(self.file, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL)
+        if self.file.tell() == 0:
+            self.writer.writerow(TRAITS_HEADERS)
+
+    def write(self, result: ImageResult):
+        self.writer.writerow(result_row(result))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def deduplicate_results(output_directory: str):
+    """
+    Rewrite traits.csv with a single row per image (the most recent one, e.g. from a retry of an image
+    that failed in an earlier run) and a single header.
+    """
     traits_csv = join(output_directory, 'traits.csv')
-    with open(traits_csv, 'a+') as file:
+    if not os.path.isfile(traits_csv):
+        return
+
+    with open(traits_csv, newline='') as file:
+        rows = [row for row in csv.reader(file, delimiter=',', quotechar='|') if row]
+
+    latest = {row[0]: row for row in rows if row != TRAITS_HEADERS}
+    if len(rows) == len(latest) + 1:
+        return
 
-        char = file.read(1)
-        file.seek(0)
-        if not char:
-            writer = csv.writer(file, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(headers)
+    print(f"Removing {len(rows) - len(latest) - 1} duplicate rows from {traits_csv}")
+    temporary = f"{traits_csv}.tmp"
+    with open(temporary, 'w', newline='') as file:
+        writer = csv.writer(file, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL)
+        writer.writerow(TRAITS_HEADERS)
+        writer.writerows(latest.values())
+    os.replace(temporary, traits_csv)
+
+
+def write_results(output_directory: str, results: List[ImageResult]):
+    table = tabulate([result_row(result) for result in results], headers=TRAITS_HEADERS, tablefmt='orgtbl')
+    print(table)
 
-        for row in results:
-            writer = csv.writer(file, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL)
-            writer.writerow(row)
+    with TraitsWriter(output_directory) as writer:
+        for result in results:
+            writer.write(result)
 
     # traits_xslx = join(output_directory, 'traits.xlsx')
 
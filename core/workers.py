@@ -0,0 +1,80 @@
+import os
+from multiprocessing import Pool
+from typing import Callable, List
+
+import cv2
+import numpy as np
+
+from core import kernels
+from core.options import ImageInput
+from core.thresholding import clahe
+
+# thread pools of native libraries that read their size from the environment when they are loaded
+THREAD_VARIABLES = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS')
+
+# the pipeline of this worker process, installed once by init_worker
+_pipeline: Callable = None
+
+
+def worker_threads(processes: int) -> int:
+    # split the cores between the workers, so their threads don't compete for them
+    return max(1, (os.cpu_count() or 1) // processes)
+
+
+def limit_threads(threads: int):
+    """
+    Limit the threads each native library starts to `threads`: OpenCV, the compiled kernels, BLAS and
+    OpenMP, both those already loaded (through threadpoolctl, if installed) and those loaded later
+    (through the environment).
+    """
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(threads)
+    cv2.setNumThreads(threads)
+    if kernels.NUMBA:
+        from numba import config, set_num_threads
+        set_num_threads(min(threads, config.NUMBA_NUM_THREADS))
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(threads)
+    except ImportError:
+        pass
+
+
+def warm_up():
+    """ create this process's shared read-only state (CLAHE instances, compiled kernels) ahead of the first image """
+    clahe()
+    image = np.zeros((8, 8), dtype=np.uint8)
+    kernels.label_stats(image.astype(np.int32), 1)
+    kernels.remap_labels(image.astype(np.int32), np.zeros(1, dtype=np.uint8))
+    kernels.nearest_centroid(np.zeros((8, 3), dtype=np.uint8), np.zeros((2, 3), dtype=np.float32))
+    kernels.double_mad_outliers(np.arange(8.0))
+
+
+def init_worker(pipeline: Callable, threads: int = 1):
+    """
+    Pool initializer: installs the pipeline (with its marker template, cache and marker positions) in
+    the worker once, instead of pickling it with every task, limits its threads and warms it up.
+    """
+    global _pipeline
+    _pipeline = pipeline
+    limit_threads(threads)
+    warm_up()
+
+
+def run_image(image: ImageInput):
+    return _pipeline(image)
+
+
+def run_images(images: List[ImageInput]) -> list:
+    return [_pipeline(image) for image in images]
+
+
+def worker_pool(pipeline: Callable, processes: int, threads: int = None, max_tasks_per_child: int = None) -> Pool:
+    """
+    A pool of `processes` workers running `pipeline` (see run_image and run_images), each with
+    `threads` threads (by default its share of the cores). Workers are replaced after
+    `max_tasks_per_child` tasks (chunks of images), which bounds the memory leaked by long runs; their
+    pending images are written before they exit.
+    """
+    threads = threads or worker_threads(processes)
+    return Pool(processes=processes, initializer=init_worker, initargs=(pipeline, threads), maxtasksperchild=max_tasks_per_child)
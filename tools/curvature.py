@@ -1,5 +1,6 @@
 import numpy as np
-from scipy import optimize
+
+from core.curvature import fit_circles
 
 
 class ComputeCurvature:
@@ -9,40 +10,14 @@ class ComputeCurvature:
         self.xc = 0  # X-coordinate of circle center
         self.yc = 0  # Y-coordinate of circle center
         self.r = 0   # Radius of the circle
-        self.xx = np.array([])  # Data points
-        self.yy = np.array([])  # Data points
-        self.x = x  # X-coordinate of circle center
-        self.y = y  # Y-coordinate of circle center
-
-    def calc_r(self, xc, yc):
-        """ calculate the distance of each 2D points from the center (xc, yc) """
-        return np.sqrt((self.xx-xc)**2 + (self.yy-yc)**2)
-
-    def f(self, c):
-        """ calculate the algebraic distance between the data points and the mean circle centered at c=(xc, yc) """
-        ri = self.calc_r(*c)
-        return ri - ri.mean()
-
-    def df(self, c):
-        """ Jacobian of f_2b
-        The axis corresponding to derivatives must be coherent with the col_deriv option of leastsq"""
-        xc, yc = c
-        df_dc = np.empty((len(c), self.x.size))
-
-        ri = self.calc_r(xc, yc)
-        df_dc[0] = (xc - self.x)/ri                   # dR/dxc
-        df_dc[1] = (yc - self.y)/ri                   # dR/dyc
-        df_dc = df_dc - df_dc.mean(axis=1)[:, np.newaxis]
-        return df_dc
+        self.x = x  # X-coordinates of the data points
+        self.y = y  # Y-coordinates of the data points
 
     def fit(self, xx, yy):
-        self.xx = xx
-        self.yy = yy
-        center_estimate = np.r_[np.mean(xx), np.mean(yy)]
-        center = optimize.leastsq(self.f, center_estimate, Dfun=self.df, col_deriv=True)[0]
+        """ fit a circle with the vectorized solver in core.curvature (algebraic fit refined geometrically) """
+        points = np.column_stack((xx, yy)).astype(np.float64)
+        xc, yc, r = fit_circles(points, np.array([0, len(points)]))
 
-        self.xc, self.yc = center
-        ri = self.calc_r(*center)
-        self.r = ri.mean()
+        self.xc, self.yc, self.r = xc[0], yc[0], r[0]
 
-        return 1 / self.r  # Return the curvature
\ No newline at end of file
+        return 1 / self.r  # Return the curvature
@@ -9,7 +9,7 @@ Author-email: suxingliu@gmail.com
 
 USAGE:
 
-python3 watershed_cv.py -p /home/suxingliu/plant-image-analysis/  -ft jpg
+python3 -m tools.watershed_cv -p /home/suxingliu/plant-image-analysis/  -ft jpg
 
 
 argument:
@@ -27,13 +27,14 @@ from contextlib import closing
 from multiprocessing import Pool
 
 import cv2
-import imutils
 import numpy as np
 from scipy import ndimage
 # import the necessary packages
 from skimage.feature import peak_local_max
 from skimage.morphology import watershed
 
+from core.regions import label_regions
+
 
 def mkdir(path):
     """Create result folder"""
@@ -113,28 +114,16 @@ def image_label(image_file):
 
 
     count = 0
-    # loop over the unique labels returned by the Watershed algorithm
-    for label in np.unique(labels):
-        # if the label is zero, we are examining the 'background'
-        # so simply ignore it
-        if label == 0:
-            continue
-     
-        # otherwise, allocate memory for the label region and draw
-        # it on the mask
-        mask = np.zeros(gray.shape, dtype="uint8")
-        mask[labels == label] = 255
-     
-        # detect contours in the mask and grab the largest one
-        cnts = cv2.findContours(mask.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        cnts = imutils.grab_contours(cnts)
-        c = max(cnts, key=cv2.contourArea)
+    # loop over the regions returned by the Watershed algorithm (the background is not one of them)
+    for region in label_regions(labels):
+        # the largest contour of the region
+        c = region.contour
      
         # draw a circle enclosing the object
         ((x, y), r) = cv2.minEnclosingCircle(c)
         if r > 80:
             cv2.circle(image, (int(x), int(y)), int(r), (0, 255, 0), 2)
-            cv2.putText(image, "#{}".format(label), (int(x) - 10, int(y)),cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
+            cv2.putText(image, "#{}".format(region.label), (int(x) - 10, int(y)),cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
             count+= 1
 
     print("[INFO] {} unique segments found".format(count))